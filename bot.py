@@ -4,16 +4,33 @@
 """
 
 import os
+import re
+import sys
 import json
+import argparse
+import asyncio
 import logging
+import heapq
+import bisect
+import functools
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from hashlib import sha1
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
 from datetime import datetime, timedelta, timezone
-from typing import Dict, List, Set, Optional, Tuple
+from itertools import islice
+from typing import Dict, Iterator, List, Set, Optional, Tuple
 import pytz  # Добавляем для работы с часовыми поясами
 
 import requests
-from telegram import Update
-from telegram.error import Conflict
-from telegram.ext import Application, CommandHandler, ContextTypes
+from requests.adapters import HTTPAdapter
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.error import BadRequest, Conflict, TelegramError
+from telegram.ext import (
+    Application, BaseUpdateProcessor, CallbackQueryHandler, CommandHandler, ContextTypes
+)
 
 # ===================== НАСТРОЙКА ЛОГИРОВАНИЯ =====================
 logging.basicConfig(
@@ -38,6 +55,136 @@ FILTER_RULES = {
     }
 }
 
+# Базовый адрес API vivacrm (можно подменить моком для отладки)
+VIVACRM_API_ROOT = "https://api.vivacrm.ru/end-user/api/v1"
+FFC_API_BASE = os.environ.get("FFC_API_BASE", f"{VIVACRM_API_ROOT}/iSkq6G")
+
+# ===================== КОНСТАНТЫ ОБНОВЛЕНИЯ КЭША =====================
+# Ширина часового диапазона, по которому считаем изменения слотов (в часах)
+REFRESH_BAND_HOURS = 3
+# Границы TTL одной даты площадки (в секундах)
+REFRESH_MIN_TTL = 120           # 2 минуты
+REFRESH_MAX_TTL = 3600          # 1 час
+REFRESH_DEFAULT_TTL = 300       # 5 минут — пока нет истории изменений
+# Сколько изменений слотов допускаем пропустить между двумя обновлениями даты
+REFRESH_TARGET_CHANGES = 0.5
+# Вес изменений вне окна фильтрации (их пользователи все равно не видят)
+REFRESH_OFFPEAK_WEIGHT = 0.2
+# Бюджет запросов в час к API одной сети (у сети можно задать свой — refresh_budget)
+REFRESH_REQUEST_BUDGET = int(os.environ.get("REFRESH_REQUEST_BUDGET", "240"))
+# Какая доля бюджета всегда остается ближнему окну, даже если дальние недели съели остальное
+REFRESH_NEAR_MIN_SHARE = 0.5
+
+# Ближнее окно (эта + следующая неделя) обновляется по расписанию выше,
+# дальние недели загружаются только по запросу пользователя
+NEAR_WEEKS = 2
+FAR_MAX_WEEKS = 8               # Насколько далеко вперед можно заглянуть
+FAR_PAGE_TTL = REFRESH_MAX_TTL * 6  # Дальние недели меняются реже ближнего окна — 6 часов
+FAR_CACHE_PAGES = 32            # Сколько страниц (площадка, неделя) держим в LRU-кэше
+
+# ===================== ПАРАЛЛЕЛЬНАЯ ОБРАБОТКА =====================
+# Сколько обновлений Telegram обрабатываем одновременно (в разных чатах)
+MAX_CONCURRENT_UPDATES = int(os.environ.get("MAX_CONCURRENT_UPDATES", "64"))
+# Пул потоков для коротких блокирующих вызовов: статистика, история, запись файлов
+BLOCKING_WORKERS = int(os.environ.get("BLOCKING_WORKERS", "8"))
+BLOCKING_EXECUTOR = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="blocking")
+# Отдельный пул для парсера: долгие обновления кэша не занимают потоки статистики
+PARSER_WORKERS = int(os.environ.get("PARSER_WORKERS", "8"))
+PARSER_EXECUTOR = ThreadPoolExecutor(max_workers=PARSER_WORKERS, thread_name_prefix="parser")
+# Выполняемые вызовы парсера: (метод, аргументы) -> общий future
+_parser_calls: Dict[Tuple, asyncio.Future] = {}
+
+async def run_blocking(func, *args):
+    """Выполняем блокирующую функцию в пуле потоков, не останавливая event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(BLOCKING_EXECUTOR, functools.partial(func, *args))
+
+async def run_parser(func, *args):
+    """
+    Вызываем метод парсера в его пуле потоков. Одинаковые одновременные вызовы
+    делят один результат: остальные ждут его в event loop, а не в потоке пула.
+    """
+    key = (func, args)
+    future = _parser_calls.get(key)
+    if future is None:
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(PARSER_EXECUTOR, functools.partial(func, *args))
+        _parser_calls[key] = future
+        future.add_done_callback(lambda _: _parser_calls.pop(key, None))
+    # Отмена одного ожидающего не должна отменять вызов для остальных
+    return await asyncio.shield(future)
+
+def synchronized(method):
+    """Выполняем метод под блокировкой объекта (self._lock) — для вызовов из пула потоков"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обновления из разных чатов обрабатываются параллельно,
+    обновления одного чата — строго по очереди.
+    Очередь чата ждет вне общего лимита MAX_CONCURRENT_UPDATES: место в нем
+    занимает только выполняемое обновление. Из нажатий кнопок одного
+    сообщения, ждущих в очереди, выполняется только последнее.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._chat_locks: Dict[int, asyncio.Lock] = {}
+        self._chat_pending: Dict[int, int] = {}  # Сколько обновлений чата ждут или выполняются
+        # Чат -> {сообщение: последнее нажатие кнопки под ним}
+        self._chat_callbacks: Dict[int, Dict[int, int]] = {}
+
+    async def process_update(self, update: object, coroutine) -> None:
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            await super().process_update(update, coroutine)
+            return
+
+        query = update.callback_query
+        message_id = query.message.message_id if query is not None and query.message else None
+        if message_id is not None:
+            self._chat_callbacks.setdefault(chat.id, {})[message_id] = update.update_id
+
+        lock = self._chat_locks.setdefault(chat.id, asyncio.Lock())
+        self._chat_pending[chat.id] = self._chat_pending.get(chat.id, 0) + 1
+        try:
+            async with lock:
+                if (message_id is not None and
+                        self._chat_callbacks[chat.id].get(message_id) != update.update_id):
+                    # Пока ждали очереди, кнопку нажали снова — хватит последнего нажатия
+                    coroutine.close()
+                    await self._skip_callback(query)
+                    return
+                # Место в общем лимите берем только на время выполнения
+                await super().process_update(update, coroutine)
+        finally:
+            self._chat_pending[chat.id] -= 1
+            if not self._chat_pending[chat.id]:
+                del self._chat_pending[chat.id]
+                del self._chat_locks[chat.id]
+                self._chat_callbacks.pop(chat.id, None)
+
+    @staticmethod
+    async def _skip_callback(query) -> None:
+        """Убираем «часики» с пропущенного нажатия"""
+        try:
+            await query.answer()
+        except TelegramError:
+            pass
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
 # ===================== УТИЛИТЫ ДЛЯ РАЗБИВКИ СООБЩЕНИЙ =====================
 def split_message(text: str, max_length: int = 4096) -> List[str]:
     """
@@ -120,32 +267,55 @@ def split_message(text: str, max_length: int = 4096) -> List[str]:
     return parts
 
 # ===================== КЛАСС ДЛЯ СТАТИСТИКИ =====================
+# Сколько храним дневную статистику слотов, дальше — недельные агрегаты
+STATS_DAILY_DAYS = 30
+# Сколько храним недельные агрегаты, дальше — помесячные (навсегда)
+STATS_WEEKLY_WEEKS = 12
+# Через сколько дней неактивности пользователь уходит в холодный архив
+STATS_USER_ARCHIVE_DAYS = int(os.environ.get("STATS_USER_ARCHIVE_DAYS", "60"))
+# На сколько файлов делим холодный архив пользователей
+STATS_COLD_SHARDS = 64
+# Не чаще одной записи файла статистики за столько секунд (остальное — в памяти)
+STATS_SAVE_INTERVAL = 30
+# Как часто сохраняем накопленное и проверяем сворачивание и архив (в секундах)
+STATS_MAINTENANCE_INTERVAL = 600
+# Сколько самых активных архивных пользователей помним для топа в /stats
+STATS_ARCHIVE_TOP_CANDIDATES = 50
+# Команды, для которых ведем счетчики использования
+STATS_COMMANDS = ('start', 'slots', 'venues', 'help', 'stats', 'history', 'next')
+
 class BotStatistics:
     """Класс для сбора и хранения статистики бота"""
     
     def __init__(self, stats_file='bot_statistics.json'):
+        self._lock = threading.RLock()
         self.stats_file = stats_file
+        self.cold_dir = os.path.splitext(stats_file)[0] + '_cold'
         self.stats = self._load_stats()
+        self._last_logged_generation = None  # Последнее учтенное обновление кэша
+        # Площадка -> слоты, уже учтенные в статистике (дата, время, зал)
+        self._logged_slots: Dict[str, Set[Tuple[str, str, str]]] = {}
+        self._cold_misses: Set[str] = set()  # ID, которых точно нет в архиве
+        self._dirty = False  # Есть изменения, еще не записанные в файл
+        self._last_save = 0.0
         
     def _load_stats(self) -> Dict:
         """Загружаем статистику из файла или создаем новую"""
         try:
             if os.path.exists(self.stats_file):
                 with open(self.stats_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                    stats = json.load(f)
+                # Счетчики команд, добавленных после создания файла
+                for command in STATS_COMMANDS:
+                    stats['commands'].setdefault(command, 0)
+                return stats
         except Exception as e:
             logger.error(f"Ошибка загрузки статистики: {e}")
         
         # Стандартная структура статистики
         return {
             'users': {},  # Информация о пользователях
-            'commands': {
-                'start': 0,
-                'slots': 0,
-                'venues': 0,
-                'help': 0,
-                'stats': 0
-            },
+            'commands': {command: 0 for command in STATS_COMMANDS},
             'total_messages': 0,
             'slots_found': {
                 'total': 0,
@@ -156,19 +326,147 @@ class BotStatistics:
             'last_update': datetime.now(MOSCOW_TZ).isoformat()
         }
     
-    def _save_stats(self):
-        """Сохраняем статистику в файл"""
+    def _save_stats(self, force: bool = False):
+        """Сохраняем статистику в файл (не чаще раза в STATS_SAVE_INTERVAL)"""
+        from time import time
+        self._dirty = True
+        if not force and time() - self._last_save < STATS_SAVE_INTERVAL:
+            return
         try:
             self.stats['last_update'] = datetime.now(MOSCOW_TZ).isoformat()
             with open(self.stats_file, 'w', encoding='utf-8') as f:
-                json.dump(self.stats, f, ensure_ascii=False, indent=2)
+                json.dump(self.stats, f, ensure_ascii=False, separators=(',', ':'))
+            self._dirty = False
+            self._last_save = time()
         except Exception as e:
             logger.error(f"Ошибка сохранения статистики: {e}")
     
+    @synchronized
+    def flush(self):
+        """Записываем накопленные изменения (периодически и при остановке бота)"""
+        if self._dirty:
+            self._save_stats(force=True)
+    
+    @synchronized
+    def run_maintenance(self):
+        """Плановое обслуживание: раз в день сворачиваем статистику и архивируем пользователей"""
+        self._clean_old_stats()
+        self.flush()
+    
+    def _cold_shard_path(self, user_id_str: str) -> str:
+        shard = int(user_id_str) % STATS_COLD_SHARDS if user_id_str.lstrip('-').isdigit() else 0
+        return os.path.join(self.cold_dir, f"{shard:02d}.json")
+    
+    def _load_cold_shard(self, path: str) -> Dict:
+        """Загружаем один файл холодного архива"""
+        try:
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки архива пользователей {path}: {e}")
+        return {}
+    
+    def _save_cold_shard(self, path: str, shard: Dict):
+        """Сохраняем один файл холодного архива"""
+        try:
+            os.makedirs(self.cold_dir, exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(shard, f, ensure_ascii=False)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения архива пользователей {path}: {e}")
+    
+    @staticmethod
+    def _top_candidates(candidates: Dict[str, Dict]) -> Dict[str, Dict]:
+        """Оставляем самых активных архивных пользователей"""
+        return dict(sorted(
+            candidates.items(), key=lambda x: x[1]['commands_used'], reverse=True
+        )[:STATS_ARCHIVE_TOP_CANDIDATES])
+    
+    def _rebuild_archive_top(self):
+        """Пересобираем кандидатов в топ по всем файлам холодного архива"""
+        candidates = {}
+        for shard in range(STATS_COLD_SHARDS):
+            path = os.path.join(self.cold_dir, f"{shard:02d}.json")
+            for user_id_str, user_data in self._load_cold_shard(path).items():
+                candidates[user_id_str] = {
+                    'first_name': user_data.get('first_name'),
+                    'commands_used': user_data.get('commands_used', 0)
+                }
+        self.stats['archive']['top_users'] = self._top_candidates(candidates)
+    
+    def _restore_user(self, user_id_str: str) -> bool:
+        """Возвращаем пользователя из холодного архива, если он там есть"""
+        if user_id_str in self._cold_misses or not self.stats.get('archive', {}).get('users'):
+            return False
+        
+        path = self._cold_shard_path(user_id_str)
+        shard = self._load_cold_shard(path)
+        if user_id_str not in shard:
+            if len(self._cold_misses) > 10000:
+                self._cold_misses.clear()
+            self._cold_misses.add(user_id_str)
+            return False
+        
+        self.stats['users'][user_id_str] = shard.pop(user_id_str)
+        self._save_cold_shard(path, shard)
+        
+        archive = self.stats['archive']
+        archive['users'] -= 1
+        if archive['top_users'].pop(user_id_str, None) is not None:
+            # Запас кандидатов кончился, а в архиве есть еще — пересобираем топ по файлам
+            if len(archive['top_users']) < min(5, archive['users']):
+                self._rebuild_archive_top()
+        # Архив уже переписан — основной файл сохраняем сразу, чтобы не потерять пользователя
+        self._save_stats(force=True)
+        logger.info(f"📊 Пользователь {user_id_str} возвращен из архива")
+        return True
+    
+    @synchronized
+    def archive_inactive_users(self):
+        """Переносим давно неактивных пользователей в холодный архив на диске"""
+        cutoff = datetime.now(MOSCOW_TZ) - timedelta(days=STATS_USER_ARCHIVE_DAYS)
+        inactive = {
+            user_id_str: user_data for user_id_str, user_data in self.stats['users'].items()
+            if datetime.fromisoformat(user_data['last_seen']) < cutoff
+        }
+        if not inactive:
+            return
+        
+        # Пишем только затронутые файлы архива
+        by_shard: Dict[str, Dict] = {}
+        for user_id_str, user_data in inactive.items():
+            by_shard.setdefault(self._cold_shard_path(user_id_str), {})[user_id_str] = user_data
+        for path, users in by_shard.items():
+            shard = self._load_cold_shard(path)
+            shard.update(users)
+            self._save_cold_shard(path, shard)
+        
+        archive = self.stats.setdefault('archive', {'users': 0, 'top_users': {}})
+        archive['users'] += len(inactive)
+        
+        # Самых активных архивных пользователей помним для топа
+        candidates = dict(archive['top_users'])
+        for user_id_str, user_data in inactive.items():
+            candidates[user_id_str] = {
+                'first_name': user_data.get('first_name'),
+                'commands_used': user_data.get('commands_used', 0)
+            }
+            del self.stats['users'][user_id_str]
+            self._cold_misses.discard(user_id_str)
+        archive['top_users'] = self._top_candidates(candidates)
+        self._save_stats(force=True)
+        
+        logger.info(f"📦 В архив перенесено пользователей: {len(inactive)}")
+    
+    @synchronized
     def add_user(self, user_id: int, username: str, first_name: str):
         """Добавляем нового пользователя или обновляем существующего"""
         user_id_str = str(user_id)
         
+        if user_id_str not in self.stats['users']:
+            self._restore_user(user_id_str)
+        
         if user_id_str not in self.stats['users']:
             self.stats['users'][user_id_str] = {
                 'username': username,
@@ -188,6 +486,7 @@ class BotStatistics:
         
         self._save_stats()
     
+    @synchronized
     def log_command(self, user_id: int, command: str):
         """Логируем использование команды"""
         user_id_str = str(user_id)
@@ -197,7 +496,11 @@ class BotStatistics:
             self.stats['commands'][command] += 1
         
         # Обновляем данные пользователя
+        if user_id_str not in self.stats['users']:
+            self._restore_user(user_id_str)
         if user_id_str in self.stats['users']:
+            # Любая команда — это активность, иначе пользователь уйдет в архив
+            self.stats['users'][user_id_str]['last_seen'] = datetime.now(MOSCOW_TZ).isoformat()
             self.stats['users'][user_id_str]['commands_used'] += 1
             self.stats['users'][user_id_str]['last_command'] = {
                 'command': command,
@@ -207,8 +510,14 @@ class BotStatistics:
         self.stats['total_messages'] += 1
         self._save_stats()
     
-    def log_slots_found(self, venue_slots: Dict):
-        """Логируем найденные слоты"""
+    @synchronized
+    def log_slots_found(self, venue_slots: Dict, generation: Optional[int] = None):
+        """Логируем найденные слоты: считаем только появившиеся с прошлого учета"""
+        if generation is not None:
+            if generation == self._last_logged_generation:
+                return
+            self._last_logged_generation = generation
+        
         today = datetime.now(MOSCOW_TZ).strftime("%Y-%m-%d")
         
         # Инициализируем счетчики для сегодняшнего дня
@@ -221,7 +530,13 @@ class BotStatistics:
         total_today = 0
         
         for venue_key, venue_data in venue_slots.items():
-            count = venue_data.get('count', 0)
+            # Площадки, взятые из кэша без изменений, и прежние слоты не учитываем повторно
+            current = {(slot['date'], slot['time'], slot.get('room', ''))
+                       for slot in venue_data.get('slots', [])}
+            count = len(current - self._logged_slots.get(venue_key, set()))
+            self._logged_slots[venue_key] = current
+            if not count:
+                continue
             
             # Общая статистика по площадкам
             venue_name = venue_data.get('name', venue_key)
@@ -243,27 +558,61 @@ class BotStatistics:
         self._clean_old_stats()
         self._save_stats()
     
+    @synchronized
+    def log_throttled(self, kind: str):
+        """Считаем отклоненные ('throttled') и объединенные ('deduped') запросы"""
+        throttling = self.stats.setdefault('throttling', {'throttled': 0, 'deduped': 0})
+        throttling[kind] = throttling.get(kind, 0) + 1
+        # Не пишем файл: отклоненный запрос должен стоить дешево,
+        # счетчики сохранятся вместе со следующей командой
+    
+    @staticmethod
+    def _merge_rollup(target: Dict, key: str, entry: Dict):
+        """Добавляем счетчики дня/недели в агрегат более крупного периода"""
+        rollup = target.setdefault(key, {'total': 0, 'venues': {}})
+        rollup['total'] += entry.get('total', 0)
+        for venue_name, count in entry.get('venues', {}).items():
+            rollup['venues'][venue_name] = rollup['venues'].get(venue_name, 0) + count
+    
     def _clean_old_stats(self):
-        """Удаляем статистику старше 30 дней"""
-        cutoff_date = (datetime.now(MOSCOW_TZ) - timedelta(days=30)).strftime("%Y-%m-%d")
-        dates_to_remove = []
-        
-        for date_str in self.stats['slots_found']['by_date']:
-            if date_str < cutoff_date:
-                dates_to_remove.append(date_str)
-        
-        for date_str in dates_to_remove:
-            del self.stats['slots_found']['by_date'][date_str]
+        """Раз в день сворачиваем старую статистику (дни -> недели -> месяцы) и архивируем пользователей"""
+        now = datetime.now(MOSCOW_TZ)
+        today = now.strftime("%Y-%m-%d")
+        if self.stats.get('last_compaction') == today:
+            return
+        self.stats['last_compaction'] = today
+        self._dirty = True
+        
+        slots_found = self.stats['slots_found']
+        by_week = slots_found.setdefault('by_week', {})
+        by_month = slots_found.setdefault('by_month', {})
+        
+        # Дни старше STATS_DAILY_DAYS -> недели (ISO)
+        cutoff_date = (now - timedelta(days=STATS_DAILY_DAYS)).strftime("%Y-%m-%d")
+        for date_str in [d for d in slots_found['by_date'] if d < cutoff_date]:
+            year, week, _ = datetime.strptime(date_str, "%Y-%m-%d").isocalendar()
+            self._merge_rollup(by_week, f"{year}-W{week:02d}", slots_found['by_date'].pop(date_str))
+        
+        # Недели старше STATS_WEEKLY_WEEKS -> месяцы (по понедельнику недели)
+        year, week, _ = (now - timedelta(weeks=STATS_WEEKLY_WEEKS)).isocalendar()
+        cutoff_week = f"{year}-W{week:02d}"
+        for week_key in [w for w in by_week if w < cutoff_week]:
+            monday = datetime.strptime(week_key + "-1", "%G-W%V-%u")
+            self._merge_rollup(by_month, monday.strftime("%Y-%m"), by_week.pop(week_key))
+        
+        self.archive_inactive_users()
     
+    @synchronized
     def get_stats_summary(self) -> str:
         """Получаем краткую статистику в виде текста"""
-        total_users = len(self.stats['users'])
+        archive = self.stats.get('archive', {'users': 0, 'top_users': {}})
+        total_users = len(self.stats['users']) + archive['users']
         active_users = sum(1 for user in self.stats['users'].values() 
                           if (datetime.now(MOSCOW_TZ) - datetime.fromisoformat(user['last_seen'])).days < 7)
         
-        # Самые активные пользователи (топ-5)
+        # Самые активные пользователи (топ-5), включая архивных
         top_users = sorted(
-            self.stats['users'].items(),
+            list(self.stats['users'].items()) + list(archive['top_users'].items()),
             key=lambda x: x[1].get('commands_used', 0),
             reverse=True
         )[:5]
@@ -281,6 +630,8 @@ class BotStatistics:
             f"• Активных (за 7 дней): {active_users}",
             f"• Всего сообщений: {self.stats['total_messages']}",
             f"• Найдено слотов: {self.stats['slots_found']['total']}",
+            f"• Отклонено частых /slots: {self.stats.get('throttling', {}).get('throttled', 0)}",
+            f"• Объединено повторных /slots: {self.stats.get('throttling', {}).get('deduped', 0)}",
             "",
             "🏆 *Топ-5 пользователей:*"
         ]
@@ -315,9 +666,11 @@ class BotStatistics:
         
         return "\n".join(summary)
     
+    @synchronized
     def get_detailed_stats(self) -> str:
         """Получаем детальную статистику"""
-        total_users = len(self.stats['users'])
+        archived_users = self.stats.get('archive', {}).get('users', 0)
+        total_users = len(self.stats['users']) + archived_users
         
         # Группируем по дням (последние 7 дней)
         last_7_days = {}
@@ -338,6 +691,7 @@ class BotStatistics:
             "👥 *Пользователи:*",
             f"• Всего: {total_users}",
             f"• Новых (7 дней): {new_users_7d}",
+            f"• В архиве (неактивны {STATS_USER_ARCHIVE_DAYS}+ дней): {archived_users}",
             "",
             "📅 *Слоты за 7 дней:*"
         ]
@@ -357,22 +711,584 @@ class BotStatistics:
             f"• Слотов найдено: {last_7_days.get(today_str, 0)}"
         ])
         
+        # Свернутая история: последние месяцы
+        by_month = self.stats['slots_found'].get('by_month', {})
+        if by_month:
+            details.extend(["", "🗓️ *Слоты по месяцам (архив):*"])
+            for month, rollup in sorted(by_month.items(), reverse=True)[:6]:
+                details.append(f"• {month}: {rollup['total']} слотов")
+        
         return "\n".join(details)
 
+# ===================== ИСТОРИЯ ДОСТУПНОСТИ СЛОТОВ =====================
+# Сколько дней после даты слота храним подробную историю
+HISTORY_RAW_DAYS = int(os.environ.get("HISTORY_RAW_DAYS", "60"))
+# Как часто сбрасываем историю на диск (в секундах)
+HISTORY_SAVE_INTERVAL = 300
+# Корзины "за сколько часов до начала освободился слот"
+HISTORY_LEAD_BUCKETS = [3, 6, 12, 24, 48, 96, 168]
+WEEKDAY_NAMES = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+
+class SlotHistoryStore:
+    """
+    Компактное хранилище истории доступности слотов.
+    Для каждой тройки (площадка, дата, минута начала) храним временной ряд
+    присутствия слота в дельта-кодировке: время первого наблюдения, начальное
+    состояние и список интервалов между переключениями. Старые ряды
+    сворачиваются в агрегаты по (площадка, день недели, минута начала).
+    """
+
+    def __init__(self, history_file='slot_history.json'):
+        self._lock = threading.RLock()
+        self.history_file = history_file
+        self._dirty = False
+        self._last_save = 0.0
+        data = self._load_history()
+        # "площадка|дата" -> {минута: {'t0': первое наблюдение, 's0': состояние, 'd': дельты}}
+        self.series: Dict[str, Dict[str, Dict]] = data['series']
+        # "площадка|дата" -> [первое наблюдение, последнее наблюдение]
+        self.observed: Dict[str, List[int]] = data['observed']
+        # "площадка|день недели" -> {минута: агрегаты по свернутым датам}
+        self.rollups: Dict[str, Dict[str, Dict]] = data['rollups']
+        # "площадка|день недели" -> сколько дат свернуто (независимо от минуты)
+        self.rollup_dates: Dict[str, int] = data.get('rollup_dates') or {
+            # Старый формат: считали даты по минутам, берем максимум как оценку
+            rollup_key: max((rollup.get('dates', 0) for rollup in venue_rollups.values()), default=0)
+            for rollup_key, venue_rollups in self.rollups.items()
+        }
+
+    def _load_history(self) -> Dict:
+        """Загружаем историю из файла или создаем новую"""
+        try:
+            if os.path.exists(self.history_file):
+                with open(self.history_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки истории слотов: {e}")
+
+        return {'series': {}, 'observed': {}, 'rollups': {}, 'rollup_dates': {}}
+
+    @synchronized
+    def save(self, force: bool = False):
+        """Сохраняем историю в файл (не чаще раза в HISTORY_SAVE_INTERVAL)"""
+        from time import time
+        if not self._dirty or (not force and time() - self._last_save < HISTORY_SAVE_INTERVAL):
+            return
+        try:
+            with open(self.history_file, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'series': self.series,
+                    'observed': self.observed,
+                    'rollups': self.rollups,
+                    'rollup_dates': self.rollup_dates
+                }, f, ensure_ascii=False, separators=(',', ':'))
+            self._dirty = False
+            self._last_save = time()
+        except Exception as e:
+            logger.error(f"Ошибка сохранения истории слотов: {e}")
+
+    @staticmethod
+    def _state(series: Dict) -> int:
+        """Текущее состояние ряда: каждая дельта — переключение"""
+        return series['s0'] ^ (len(series['d']) % 2)
+
+    @staticmethod
+    def _toggle_times(series: Dict) -> List[int]:
+        """Восстанавливаем абсолютные времена переключений из дельт"""
+        times = []
+        current = series['t0']
+        for delta in series['d']:
+            current += delta
+            times.append(current)
+        return times
+
+    @synchronized
+    def record_snapshot(self, venue_key: str, date_str: str, slots: List[Dict], timestamp: float):
+        """Записываем снимок доступности одной даты площадки"""
+        now = int(timestamp)
+        date_key = f"{venue_key}|{date_str}"
+        present = {int(slot['start'][:2]) * 60 + int(slot['start'][3:5]) for slot in slots}
+
+        observed = self.observed.get(date_key)
+        first_seen = observed is None
+        if first_seen:
+            self.observed[date_key] = [now, now]
+        else:
+            observed[1] = now
+
+        date_series = self.series.setdefault(date_key, {})
+        for minute in present | {int(known) for known in date_series}:
+            series = date_series.get(str(minute))
+            state = 1 if minute in present else 0
+
+            if series is None:
+                if first_seen:
+                    date_series[str(minute)] = {'t0': now, 's0': 1, 'd': []}
+                else:
+                    # Дата уже наблюдалась, а слота не было — значит, он освободился
+                    t0 = self.observed[date_key][0]
+                    date_series[str(minute)] = {'t0': t0, 's0': 0, 'd': [now - t0]}
+            elif self._state(series) != state:
+                last_toggle = series['t0'] + sum(series['d'])
+                series['d'].append(now - last_toggle)
+
+        self._dirty = True
+
+    def _free_up_events(self, series: Dict) -> List[int]:
+        """Моменты, когда слот появился в продаже (переход 0 -> 1)"""
+        times = self._toggle_times(series)
+        state = series['s0']
+        events = []
+        for toggle_time in times:
+            state ^= 1
+            if state == 1:
+                events.append(toggle_time)
+        return events
+
+    @staticmethod
+    def _lead_bucket(lead_hours: float) -> int:
+        for index, bound in enumerate(HISTORY_LEAD_BUCKETS):
+            if lead_hours < bound:
+                return index
+        return len(HISTORY_LEAD_BUCKETS)
+
+    @staticmethod
+    def _slot_start(date_str: str, minute: int) -> datetime:
+        day = MOSCOW_TZ.localize(datetime.strptime(date_str, "%Y-%m-%d"))
+        return day + timedelta(minutes=minute)
+
+    def _series_summary(self, date_str: str, minute: int, series: Dict) -> Dict:
+        """Сводка по одному ряду: был ли слот свободен и когда освобождался"""
+        slot_start = self._slot_start(date_str, minute).timestamp()
+        leads = []
+        hours = []
+        for event in self._free_up_events(series):
+            if event <= slot_start:
+                leads.append(self._lead_bucket((slot_start - event) / 3600))
+                hours.append(datetime.fromtimestamp(event, MOSCOW_TZ).hour)
+        return {
+            'free': bool(series['s0'] or series['d']),
+            'leads': leads,
+            'hours': hours
+        }
+
+    @synchronized
+    def compact(self, now: Optional[float] = None):
+        """Сворачиваем ряды старше HISTORY_RAW_DAYS в агрегаты по дню недели"""
+        from time import time
+        now = now or time()
+        cutoff = datetime.fromtimestamp(now, MOSCOW_TZ) - timedelta(days=HISTORY_RAW_DAYS)
+        cutoff_str = cutoff.strftime("%Y-%m-%d")
+
+        old_dates = [key for key in self.observed if key.split('|')[1] < cutoff_str]
+        if not old_dates:
+            return
+
+        for date_key in old_dates:
+            venue_key, date_str = date_key.split('|')
+            weekday = datetime.strptime(date_str, "%Y-%m-%d").weekday()
+            rollup_key = f"{venue_key}|{weekday}"
+            # Дата учитывается для всех минут, даже если слот в этот день ни разу не появлялся
+            self.rollup_dates[rollup_key] = self.rollup_dates.get(rollup_key, 0) + 1
+            venue_rollups = self.rollups.setdefault(rollup_key, {})
+            for minute, series in self.series.pop(date_key, {}).items():
+                summary = self._series_summary(date_str, int(minute), series)
+                rollup = venue_rollups.setdefault(minute, {
+                    'free_dates': 0,
+                    'leads': [0] * (len(HISTORY_LEAD_BUCKETS) + 1),
+                    'hours': [0] * 24
+                })
+                rollup['free_dates'] += int(summary['free'])
+                for bucket in summary['leads']:
+                    rollup['leads'][bucket] += 1
+                for hour in summary['hours']:
+                    rollup['hours'][hour] += 1
+            del self.observed[date_key]
+
+        self._dirty = True
+        logger.info(f"🗜️ История слотов: свернуто {len(old_dates)} дат в агрегаты")
+
+    @synchronized
+    def query_free_ups(self, weekday: int, minute: int, venue_key: Optional[str] = None) -> Dict:
+        """Когда обычно освобождаются слоты на заданный день недели и время"""
+        result = {
+            'dates': 0,
+            'free_dates': 0,
+            'leads': [0] * (len(HISTORY_LEAD_BUCKETS) + 1),
+            'hours': [0] * 24
+        }
+
+        # Свернутые агрегаты
+        for rollup_key, rollup_dates in self.rollup_dates.items():
+            rollup_venue, rollup_weekday = rollup_key.split('|')
+            if int(rollup_weekday) != weekday or (venue_key and rollup_venue != venue_key):
+                continue
+            result['dates'] += rollup_dates
+            rollup = self.rollups.get(rollup_key, {}).get(str(minute))
+            if rollup is None:
+                continue
+            result['free_dates'] += rollup['free_dates']
+            for index, count in enumerate(rollup['leads']):
+                result['leads'][index] += count
+            for hour, count in enumerate(rollup['hours']):
+                result['hours'][hour] += count
+
+        # Подробная история по датам, которые наблюдались
+        for date_key in self.observed:
+            date_venue, date_str = date_key.split('|')
+            if venue_key and date_venue != venue_key:
+                continue
+            if datetime.strptime(date_str, "%Y-%m-%d").weekday() != weekday:
+                continue
+            result['dates'] += 1
+            series = self.series.get(date_key, {}).get(str(minute))
+            if series is None:
+                continue
+            summary = self._series_summary(date_str, minute, series)
+            result['free_dates'] += int(summary['free'])
+            for bucket in summary['leads']:
+                result['leads'][bucket] += 1
+            for hour in summary['hours']:
+                result['hours'][hour] += 1
+
+        return result
+
+    @synchronized
+    def get_summary(self) -> str:
+        """Краткая сводка о хранилище"""
+        all_series = [series for date_series in self.series.values() for series in date_series.values()]
+        toggles = sum(len(series['d']) for series in all_series)
+        return "\n".join([
+            "🗂️ *ИСТОРИЯ СЛОТОВ*",
+            f"• Дат с подробной историей: {len(self.observed)}",
+            f"• Временных рядов: {len(all_series)}",
+            f"• Переключений доступности: {toggles}",
+            f"• Агрегатов по дням недели: {sum(len(r) for r in self.rollups.values())}",
+            "",
+            "Пример запроса: `/history сб 10:00`"
+        ])
+
+    def format_free_ups(self, weekday: int, minute: int, venue_key: Optional[str] = None) -> str:
+        """Ответ на вопрос "когда обычно освобождаются слоты" в виде текста"""
+        from time import perf_counter
+        started = perf_counter()
+        result = self.query_free_ups(weekday, minute, venue_key)
+        elapsed_ms = (perf_counter() - started) * 1000
+
+        slot_label = f"{WEEKDAY_NAMES[weekday]} {minute // 60:02d}:{minute % 60:02d}"
+        lines = [f"🕰️ *История слота {slot_label}*", ""]
+
+        if not result['dates']:
+            lines.append("_Пока нет данных по этому дню недели._")
+        else:
+            lines.append(f"• Дат в истории: {result['dates']}")
+            lines.append(f"• Был свободен хотя бы раз: {result['free_dates']} из {result['dates']} дат")
+
+            total_events = sum(result['leads'])
+            if total_events:
+                lines.extend(["", "⏳ *За сколько до начала освобождался:*"])
+                for index, count in enumerate(result['leads']):
+                    if not count:
+                        continue
+                    if index < len(HISTORY_LEAD_BUCKETS):
+                        lower = HISTORY_LEAD_BUCKETS[index - 1] if index else 0
+                        label = f"{lower}–{HISTORY_LEAD_BUCKETS[index]} ч"
+                    else:
+                        label = f"более {HISTORY_LEAD_BUCKETS[-1]} ч"
+                    lines.append(f"• {label}: {count * 100 // total_events}%")
+
+                top_hours = sorted(range(24), key=lambda hour: result['hours'][hour], reverse=True)[:3]
+                top_hours = [hour for hour in top_hours if result['hours'][hour]]
+                lines.append("")
+                lines.append("🔔 Чаще всего освобождается около: " +
+                             ", ".join(f"{hour:02d}:00" for hour in top_hours))
+            else:
+                lines.append("_Освобождений этого слота пока не замечено._")
+
+        lines.extend(["", f"_Запрос выполнен за {elapsed_ms:.1f} мс_"])
+        return "\n".join(lines)
+
 # ===================== СОЗДАЕМ ОБЪЕКТЫ =====================
 parser = None  # Будет инициализирован в main
 statistics = None  # Будет инициализирован в main
+history = None  # Будет инициализирован в main
+throttler = None  # Будет инициализирован в main
 TOKEN = os.environ.get("BOT_TOKEN")
 ADMIN_IDS = os.environ.get("ADMIN_IDS", "").split(",")  # ID админов через запятую
 
-# ===================== КЛАСС ПАРСЕРА FFC =====================
-class FFCParser:
-    def __init__(self):
-        self.headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
-            "Content-Type": "application/json",
-        }
-        self.venues = {
+# ===================== АДАПТИВНОЕ РАСПИСАНИЕ ОБНОВЛЕНИЙ =====================
+class RefreshScheduler:
+    """
+    Расписание обновления кэша, обученное на истории изменений слотов.
+    Для каждой тройки (площадка, дата, часовой диапазон) считаем, как часто
+    слоты появляются и исчезают между запросами, и по этим данным назначаем
+    TTL каждой даты в пределах общего бюджета запросов к API.
+    """
+
+    def __init__(self, budget_per_hour: int = REFRESH_REQUEST_BUDGET, alpha: float = 0.3):
+        self.budget_per_hour = budget_per_hour
+        self.alpha = alpha  # Вес нового наблюдения в скользящем среднем
+        self.bands = range(24 // REFRESH_BAND_HOURS)
+        # (площадка, дата, диапазон) -> изменений слотов в час
+        self._churn: Dict[Tuple[str, str, int], float] = {}
+        # (площадка, день недели, диапазон) -> изменений в час, для дат без истории
+        self._priors: Dict[Tuple[str, int, int], float] = {}
+        # (площадка, дата) -> время последнего успешного запроса
+        self._last_fetch: Dict[Tuple[str, str], float] = {}
+        # Время запросов вне расписания (дальние недели) за последний час
+        self._extra_requests: deque = deque()
+        self._over_budget = False  # Чтобы предупреждать о нехватке бюджета один раз
+
+    def _ewma(self, previous: Optional[float], value: float) -> float:
+        if previous is None:
+            return value
+        return previous + self.alpha * (value - previous)
+
+    def _keys_by_band(self, slots: List[Dict]) -> Dict[int, Set[Tuple[str, str]]]:
+        """Раскладываем слоты по часовым диапазонам"""
+        bands: Dict[int, Set[Tuple[str, str]]] = {}
+        for slot in slots:
+            band = int(slot['start'][:2]) // REFRESH_BAND_HOURS
+            bands.setdefault(band, set()).add((slot['start'], slot['room']))
+        return bands
+
+    def _band_weight(self, weekday: int, band: int) -> float:
+        """Диапазоны внутри окна фильтрации важнее остальных"""
+        rules = FILTER_RULES['weekday' if weekday < 5 else 'weekend']
+        band_start = band * REFRESH_BAND_HOURS * 60
+        band_end = band_start + REFRESH_BAND_HOURS * 60
+        if band_start < rules['end_minutes'] and band_end > rules['start_minutes']:
+            return 1.0
+        return REFRESH_OFFPEAK_WEIGHT
+
+    def record(self, venue_key: str, date_str: str, old_slots: Optional[List[Dict]],
+               new_slots: List[Dict], now: float):
+        """Учитываем изменения слотов между двумя запросами одной даты"""
+        key = (venue_key, date_str)
+        last = self._last_fetch.get(key)
+        self._last_fetch[key] = now
+        if old_slots is None or last is None:
+            return
+
+        elapsed_hours = max(now - last, 60) / 3600
+        old_bands = self._keys_by_band(old_slots)
+        new_bands = self._keys_by_band(new_slots)
+        weekday = datetime.strptime(date_str, "%Y-%m-%d").weekday()
+
+        for band in self.bands:
+            changes = len(old_bands.get(band, set()) ^ new_bands.get(band, set()))
+            rate = changes / elapsed_hours
+            churn_key = (venue_key, date_str, band)
+            self._churn[churn_key] = self._ewma(self._churn.get(churn_key), rate)
+            prior_key = (venue_key, weekday, band)
+            self._priors[prior_key] = self._ewma(self._priors.get(prior_key), rate)
+
+    def churn_rate(self, venue_key: str, date_str: str) -> Optional[float]:
+        """Взвешенная частота изменений по дате (в час) или None, если истории нет"""
+        weekday = datetime.strptime(date_str, "%Y-%m-%d").weekday()
+        rates = [self._churn.get((venue_key, date_str, band)) for band in self.bands]
+        if all(rate is None for rate in rates):
+            # Новая дата — опираемся на историю того же дня недели
+            rates = [self._priors.get((venue_key, weekday, band)) for band in self.bands]
+            if all(rate is None for rate in rates):
+                return None
+
+        return sum((rate or 0.0) * self._band_weight(weekday, band)
+                   for band, rate in zip(self.bands, rates))
+
+    def plan(self, keys: List[Tuple[str, str]], today: datetime) -> Dict[Tuple[str, str], float]:
+        """Рассчитываем TTL (в секундах) для каждой пары (площадка, дата)"""
+        ttls = {}
+        for venue_key, date_str in keys:
+            rate = self.churn_rate(venue_key, date_str)
+            if rate is None:
+                ttls[(venue_key, date_str)] = REFRESH_DEFAULT_TTL
+                continue
+
+            # Дальние даты интересны меньше ближайших
+            days_ahead = (datetime.strptime(date_str, "%Y-%m-%d").date() - today.date()).days
+            weighted_rate = rate / (1 + max(days_ahead, 0) / 7)
+
+            if weighted_rate > 0:
+                ttl = 3600 * REFRESH_TARGET_CHANGES / weighted_rate
+            else:
+                ttl = REFRESH_MAX_TTL
+            ttls[(venue_key, date_str)] = min(max(ttl, REFRESH_MIN_TTL), REFRESH_MAX_TTL)
+
+        # Запросы дальних недель за последний час расходуют тот же бюджет
+        budget = max(self.budget_per_hour - self._extra_per_hour(today.timestamp()),
+                     self.budget_per_hour * REFRESH_NEAR_MIN_SHARE)
+        return self._fit_budget(ttls, budget)
+
+    def _fit_budget(self, ttls: Dict[Tuple[str, str], float], budget: float) -> Dict[Tuple[str, str], float]:
+        """
+        Растягиваем TTL пропорционально, пока запросов в час не станет не больше budget.
+        Даты, упершиеся в REFRESH_MAX_TTL, дальше не растягиваются — их долю
+        бюджета забирают остальные. Если и на максимальных TTL бюджета не хватает,
+        все даты получают одинаковый TTL больше максимума.
+        """
+        if sum(3600 / ttl for ttl in ttls.values()) <= budget:
+            self._over_budget = False
+            return ttls
+
+        fitted = dict(ttls)
+        capped: Set[Tuple[str, str]] = set()
+        while len(capped) < len(ttls):
+            budget_left = budget - len(capped) * 3600 / REFRESH_MAX_TTL
+            if budget_left <= 0:
+                break
+            free = [key for key in ttls if key not in capped]
+            scale = max(sum(3600 / ttls[key] for key in free) / budget_left, 1.0)
+            newly_capped = [key for key in free if ttls[key] * scale >= REFRESH_MAX_TTL]
+            if not newly_capped:
+                for key in free:
+                    fitted[key] = ttls[key] * scale
+                self._over_budget = False
+                return fitted
+            for key in newly_capped:
+                fitted[key] = REFRESH_MAX_TTL
+            capped.update(newly_capped)
+
+        uniform_ttl = 3600 * len(ttls) / max(budget, 1)
+        if not self._over_budget:
+            logger.warning(
+                f"⚠️ Бюджета {budget:.0f} запросов/ч не хватает на {len(ttls)} дат "
+                f"даже при TTL {REFRESH_MAX_TTL} с — обновляем раз в {uniform_ttl:.0f} с"
+            )
+            self._over_budget = True
+        return {key: max(ttl, uniform_ttl) for key, ttl in ttls.items()}
+
+    def _extra_per_hour(self, now: float) -> int:
+        """Сколько запросов вне расписания сделано за последний час"""
+        while self._extra_requests and now - self._extra_requests[0] >= 3600:
+            self._extra_requests.popleft()
+        return len(self._extra_requests)
+
+    def note_requests(self, count: int, now: float):
+        """Учитываем запросы вне расписания (дальние недели) в бюджете"""
+        self._extra_requests.extend([now] * count)
+
+    def forget(self, active_keys: Set[Tuple[str, str]]):
+        """Удаляем историю дат, которые вышли из периода поиска"""
+        self._last_fetch = {key: ts for key, ts in self._last_fetch.items() if key in active_keys}
+        self._churn = {key: rate for key, rate in self._churn.items()
+                       if (key[0], key[1]) in active_keys}
+
+# ===================== СВОБОДНЫЕ ИНТЕРВАЛЫ =====================
+# Минимальная длина интервала, который показываем пользователю (в минутах)
+FREE_BLOCK_MIN_MINUTES = 30
+
+def format_minutes(minutes: int) -> str:
+    """Минуты от начала суток -> ЧЧ:ММ (24:00 для конца суток)"""
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+def format_block_price(price: float) -> str:
+    """Цена интервала: минимальная цена одного слота в нем, а не стоимость всего интервала"""
+    return f"от {int(price):,} руб. за слот".replace(',', ' ')
+
+class FreeBlocks:
+    """
+    Свободные интервалы одного зала за один день (в минутах от начала суток).
+    Соседние и пересекающиеся слоты сливаются в максимальные интервалы;
+    поиск интервала нужной длины в окне — за O(log n): бинарный поиск
+    по границам + sparse table максимумов длин внутренних интервалов.
+    """
+
+    def __init__(self, intervals: List[Tuple[int, int, float]]):
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+        self.prices: List[float] = []  # Минимальная цена слотов интервала
+
+        for start, end, price in sorted(intervals):
+            if self.ends and start <= self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], end)
+                self.prices[-1] = min(self.prices[-1], price)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+                self.prices.append(price)
+
+        # sparse[k][i] — максимальная длина среди интервалов i .. i + 2^k - 1
+        lengths = [end - start for start, end in zip(self.starts, self.ends)]
+        self._sparse = [lengths]
+        width = 1
+        while width * 2 <= len(lengths):
+            previous = self._sparse[-1]
+            self._sparse.append([max(previous[i], previous[i + width])
+                                 for i in range(len(lengths) - width * 2 + 1)])
+            width *= 2
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def _max_length(self, lo: int, hi: int) -> int:
+        """Максимальная длина среди интервалов [lo, hi) за O(1)"""
+        if lo >= hi:
+            return 0
+        level = (hi - lo).bit_length() - 1
+        return max(self._sparse[level][lo], self._sparse[level][hi - (1 << level)])
+
+    def _clip(self, index: int, window_start: int, window_end: int) -> Tuple[int, int, float]:
+        return (max(self.starts[index], window_start), min(self.ends[index], window_end),
+                self.prices[index])
+
+    def find_block(self, length: int, window_start: int,
+                   window_end: int) -> Optional[Tuple[int, int, float]]:
+        """Самый ранний интервал длиной от length внутри окна (обрезанный окном)"""
+        first = bisect.bisect_right(self.ends, window_start)   # первый, кто заканчивается позже начала окна
+        last = bisect.bisect_left(self.starts, window_end)     # интервалы [first, last) задевают окно
+        if first >= last:
+            return None
+
+        candidate = self._clip(first, window_start, window_end)
+        if candidate[1] - candidate[0] >= length:
+            return candidate
+
+        # Внутренние интервалы целиком лежат в окне: ищем самый левый достаточно длинный
+        lo, hi = first + 1, last - 1
+        if self._max_length(lo, hi) >= length:
+            while hi - lo > 1:
+                middle = (lo + hi) // 2
+                if self._max_length(lo, middle) >= length:
+                    hi = middle
+                else:
+                    lo = middle
+            return self._clip(lo, window_start, window_end)
+
+        if last - 1 > first:
+            candidate = self._clip(last - 1, window_start, window_end)
+            if candidate[1] - candidate[0] >= length:
+                return candidate
+        return None
+
+    def blocks_in_window(self, window_start: int, window_end: int,
+                         min_length: int) -> List[Tuple[int, int, float]]:
+        """Все интервалы, обрезанные окном, длиной от min_length"""
+        first = bisect.bisect_right(self.ends, window_start)
+        last = bisect.bisect_left(self.starts, window_end)
+        blocks = []
+        for index in range(first, last):
+            block = self._clip(index, window_start, window_end)
+            if block[1] - block[0] >= min_length:
+                blocks.append(block)
+        return blocks
+
+# ===================== ТЕНАНТЫ (СЕТИ КЛУБОВ) =====================
+# Каждая сеть — отдельный аккаунт vivacrm со своими площадками
+TENANTS_FILE = os.environ.get("FFC_TENANTS_FILE")
+# Общее число потоков запросов; 0 — по сумме лимитов сетей, чтобы каждая могла выбрать свой
+FETCH_WORKERS = int(os.environ.get("FETCH_WORKERS", "0"))
+TENANT_CONCURRENCY = 4  # Одновременных запросов к одной сети по умолчанию
+
+DEFAULT_FETCH_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
+    "Content-Type": "application/json",
+}
+
+DEFAULT_TENANTS = {
+    "ffc": {
+        "api_base": FFC_API_BASE,
+        "venues": {
             "seliger": {
                 "id": "de503e35-1a81-430c-b919-c2e8fac638c2",
                 "name": "Селигерская (Футбольный манеж)",
@@ -381,26 +1297,232 @@ class FFCParser:
                 "id": "9da0ba06-e433-43cd-b955-1981d0734b9f",
                 "name": "Кантемировская",
             },
+        },
+    },
+}
+
+def load_tenants(tenants_file: Optional[str] = TENANTS_FILE) -> Dict[str, Dict]:
+    """Загружаем сети клубов: JSON-файл {сеть: {account|api_base, venues, ...}} или сеть FFC"""
+    if not tenants_file:
+        return DEFAULT_TENANTS
+    
+    with open(tenants_file, 'r', encoding='utf-8') as f:
+        tenants = json.load(f)
+    if not isinstance(tenants, dict) or not tenants:
+        raise ValueError(f"{tenants_file}: нужна хотя бы одна сеть клубов")
+    
+    # Ключи площадок общие для команд и кэшей, поэтому должны быть уникальны
+    seen_venues: Dict[str, str] = {}
+    for tenant_name, config in tenants.items():
+        if not config.get('api_base') and not config.get('account'):
+            raise ValueError(f"Сеть {tenant_name}: нужен api_base или account")
+        for venue_key in config.get('venues', {}):
+            if venue_key in seen_venues:
+                raise ValueError(
+                    f"Площадка {venue_key} есть в сетях {seen_venues[venue_key]} и {tenant_name}"
+                )
+            seen_venues[venue_key] = tenant_name
+    return tenants
+
+class TenantFetchPool:
+    """Пул запросов одной сети: свой адрес, заголовки, HTTP-соединения и лимит параллельности"""
+    
+    def __init__(self, name: str, config: Dict, api_base: Optional[str] = None):
+        self.name = name
+        self.api_base = (
+            api_base or config.get('api_base') or f"{VIVACRM_API_ROOT}/{config['account']}"
+        ).rstrip('/')
+        self.headers = {**DEFAULT_FETCH_HEADERS, **config.get('headers', {})}
+        self.concurrency = max(1, int(config.get('concurrency', TENANT_CONCURRENCY)))
+        self.refresh_budget = int(config.get('refresh_budget', REFRESH_REQUEST_BUDGET))
+        self.venues = config.get('venues', {})
+        
+        # Соединения переиспользуются: пул не меньше лимита параллельности сети
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+    
+    def post(self, path: str, payload: Dict) -> requests.Response:
+        """POST-запрос к API сети через ее пул соединений"""
+        return self.session.post(f"{self.api_base}{path}", json=payload, headers=self.headers, timeout=10)
+    
+    def close(self):
+        self.session.close()
+
+class FairFetchScheduler:
+    """Общие потоки запросов, которые по очереди обслуживают сети (round-robin).
+    
+    У каждой сети своя очередь и свой лимит одновременных запросов: медленная
+    или большая сеть занимает не больше своего лимита, а свободные потоки
+    достаются следующим сетям с ожидающими запросами. Фоновые задачи сети
+    (дальние недели) выполняются, только когда ее обычная очередь пуста,
+    и не занимают последнее место в лимите сети.
+    """
+    
+    def __init__(self, pools: Dict[str, TenantFetchPool], workers: int = FETCH_WORKERS):
+        self.pools = pools
+        workers = workers or sum(pool.concurrency for pool in pools.values())
+        self._queues: Dict[str, deque] = {name: deque() for name in pools}
+        self._background: Dict[str, deque] = {name: deque() for name in pools}
+        self._active: Dict[str, int] = {name: 0 for name in pools}
+        self._order = deque(pools)
+        self._condition = threading.Condition()
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"fetch-{index}", daemon=True)
+            for index in range(max(1, workers))
+        ]
+        for thread in self._threads:
+            thread.start()
+    
+    def submit(self, tenant: str, func, *args, background: bool = False) -> Future:
+        """Ставим задачу в очередь сети"""
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Планировщик запросов остановлен")
+            queues = self._background if background else self._queues
+            queues[tenant].append((future, func, args))
+            self._condition.notify()
+        return future
+    
+    def map(self, tenant: str, func, items: List[Tuple], background: bool = False) -> List:
+        """Выполняем func(*item) для всех элементов в пуле сети и ждем результаты по порядку"""
+        futures = [self.submit(tenant, func, *item, background=background) for item in items]
+        return [future.result() for future in futures]
+    
+    def _next_job(self):
+        """Следующая задача: первая по кругу сеть с очередью и свободным лимитом (под self._condition)"""
+        for _ in range(len(self._order)):
+            tenant = self._order[0]
+            self._order.rotate(-1)
+            concurrency = self.pools[tenant].concurrency
+            if self._active[tenant] >= concurrency:
+                continue
+            queue = self._queues[tenant]
+            # Одно место в лимите сети оставляем обычным задачам
+            if not queue and self._active[tenant] < max(1, concurrency - 1):
+                queue = self._background[tenant]
+            if queue:
+                self._active[tenant] += 1
+                return tenant, queue.popleft()
+        return None
+    
+    def _worker(self):
+        while True:
+            with self._condition:
+                job = self._next_job()
+                while job is None:
+                    if self._closed:
+                        return
+                    self._condition.wait()
+                    job = self._next_job()
+            
+            tenant, (future, func, args) = job
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(func(*args))
+                    except Exception as e:
+                        future.set_exception(e)
+            finally:
+                with self._condition:
+                    self._active[tenant] -= 1
+                    # Освободился лимит сети — ее очередь может ждать именно его
+                    self._condition.notify_all()
+    
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        """Очереди и активные запросы по сетям"""
+        with self._condition:
+            return {
+                tenant: {
+                    'queued': len(self._queues[tenant]) + len(self._background[tenant]),
+                    'active': self._active[tenant]
+                }
+                for tenant in self.pools
+            }
+    
+    def shutdown(self):
+        """Останавливаем потоки после выполнения очереди и закрываем соединения"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        for pool in self.pools.values():
+            pool.close()
+
+# ===================== КЛАСС ПАРСЕРА FFC =====================
+class FFCParser:
+    def __init__(self, history: Optional[SlotHistoryStore] = None, api_base: Optional[str] = None,
+                 tenants: Optional[Dict[str, Dict]] = None):
+        # СЕТИ: у каждой свой пул запросов; api_base подменяет адрес всех сетей (мок)
+        tenants = tenants if tenants is not None else load_tenants()
+        self.pools = {name: TenantFetchPool(name, config, api_base) for name, config in tenants.items()}
+        self.fetcher = FairFetchScheduler(self.pools)
+        self.api_base = next(iter(self.pools.values())).api_base
+        
+        # Площадки всех сетей; сеть площадки определяет ее пул и пространство кэша
+        self.venues = {
+            venue_key: {**venue_info, 'tenant': pool.name}
+            for pool in self.pools.values()
+            for venue_key, venue_info in pool.venues.items()
         }
+        self._venue_pools = {venue_info['id']: self.pools[venue_info['tenant']]
+                             for venue_info in self.venues.values()}
         
-        # КЭШ: храним результаты на 5 минут
+        # КЭШ: собранный результат по всем площадкам
         self._cache = {
             'data': None,
             'timestamp': None,
-            'ttl': 300  # 5 минут в секундах
+            'ttl': REFRESH_DEFAULT_TTL,  # TTL ближайшей к устареванию даты
+            'generation': 0  # Номер обновления, растет при каждом парсинге
         }
-        logger.info("✅ Парсер инициализирован с кэшированием (5 минут)")
+        # КЭШ ПО ДАТАМ: (площадка, дата) -> разобранные слоты и время запроса
+        self._day_cache: Dict[Tuple[str, str], Dict] = {}
+        # ДАЛЬНИЕ НЕДЕЛИ: (площадка, понедельник) -> результат, в порядке LRU
+        self._far_pages: "OrderedDict[Tuple[str, str], Dict]" = OrderedDict()
+        # Одна загрузка страницы за раз: [блокировка, сколько потоков ее держат или ждут]
+        self._far_locks: Dict[Tuple[str, str], List] = {}
+        # ИНТЕРВАЛЫ: площадка -> (дата, зал) -> свободные интервалы
+        self._free_blocks: Dict[str, Dict[Tuple[str, str], FreeBlocks]] = {}
+        # РАСПИСАНИЕ: у каждой сети свой бюджет запросов к ее API
+        self.schedulers = {name: RefreshScheduler(pool.refresh_budget) for name, pool in self.pools.items()}
+        self.history = history
+        self._lock = threading.RLock()  # Защищает кэш дат и общий кэш
+        # Одно обновление площадки за раз, параллельные запросы ждут его
+        self._venue_locks = {venue_key: threading.Lock() for venue_key in self.venues}
+        logger.info("✅ Парсер инициализирован с адаптивным кэшированием")
 
-    def _is_cache_valid(self):
-        """Проверяем, актуален ли кэш"""
-        if not self._cache['data'] or not self._cache['timestamp']:
-            return False
-        
-        from time import time
-        current_time = time()
-        cache_age = current_time - self._cache['timestamp']
-        
-        return cache_age < self._cache['ttl']
+    def _scheduler(self, venue_key: str) -> RefreshScheduler:
+        """Расписание сети, к которой относится площадка"""
+        return self.schedulers[self.venues[venue_key]['tenant']]
+
+    def _search_keys(self) -> List[Tuple[str, str]]:
+        """Все пары (площадка, дата) текущего периода поиска"""
+        start_date, total_days = self.get_search_period()
+        dates = [(start_date + timedelta(days=offset)).strftime("%Y-%m-%d")
+                 for offset in range(total_days + 1)]
+        return [(venue_key, date_str) for venue_key in self.venues for date_str in dates]
+
+    def _stale_keys(self, keys: List[Tuple[str, str]], current_time: float) -> List[Tuple[str, str]]:
+        """Выбираем даты, которые пора обновить по адаптивному расписанию"""
+        now = datetime.now(MOSCOW_TZ)
+        by_tenant: Dict[str, List[Tuple[str, str]]] = {}
+        for key in keys:
+            by_tenant.setdefault(self.venues[key[0]]['tenant'], []).append(key)
+        ttls = {}
+        for tenant, tenant_keys in by_tenant.items():
+            ttls.update(self.schedulers[tenant].plan(tenant_keys, now))
+        self._cache['ttl'] = min(ttls.values()) if ttls else REFRESH_DEFAULT_TTL
+
+        stale = []
+        for key in keys:
+            entry = self._day_cache.get(key)
+            if entry is None or current_time - entry['timestamp'] >= ttls[key]:
+                stale.append(key)
+        return stale
 
     def get_search_period(self):
         """Рассчитываем период: сегодня + следующая неделя"""
@@ -409,18 +1531,18 @@ class FFCParser:
         total_days = days_to_weekend + 7      # + следующая неделя
         return today, total_days
 
-    def fetch_slots_from_api(self, venue_id: str, date_str: str):
-        """Получаем слоты с API FFC"""
-        url = f"https://api.vivacrm.ru/end-user/api/v1/iSkq6G/products/master-services/{venue_id}/timeslots"
+    def fetch_slots_from_api(self, venue_id: str, date_str: str) -> Optional[List]:
+        """Получаем слоты с API FFC (None — если запрос не удался)"""
+        pool = self._venue_pools[venue_id]
         payload = {"date": date_str, "trainers": {"type": "NO_TRAINER"}}
         
         try:
-            response = requests.post(url, json=payload, headers=self.headers, timeout=10)
+            response = pool.post(f"/products/master-services/{venue_id}/timeslots", payload)
             data = response.json()
             return data.get("byTrainer", {}).get("NO_TRAINER", {}).get("slots", [])
         except Exception as e:
             logger.error(f"Ошибка API для {date_str}: {e}")
-            return []
+            return None
 
     def parse_duration(self, duration_str: str) -> int:
         """Преобразуем PT1H30M в минуты"""
@@ -441,149 +1563,358 @@ class FFCParser:
         
         return minutes if minutes > 0 else 30
 
-    def parse_all_slots(self, venue_id: str) -> List[Dict]:
-        """Основной метод парсинга слотов"""
-        start_date, total_days = self.get_search_period()
-        all_slots = []
+    def parse_day_slots(self, raw_slots: List) -> List[Dict]:
+        """Разбираем сырые слоты одного дня из ответа API"""
+        day_slots = []
+        for slot_group in raw_slots:
+            for slot in slot_group:
+                try:
+                    time_from = slot.get("timeFrom", "")
+                    time_to = slot.get("timeTo", "")
+                    duration = slot.get("availableDuration", "PT30M")
+                    
+                    dt_from = datetime.fromisoformat(time_from.replace('Z', '+00:00'))
+                    dt_to = datetime.fromisoformat(time_to.replace('Z', '+00:00'))
+                    
+                    # Конвертируем в московское время
+                    dt_from_moscow = dt_from.astimezone(MOSCOW_TZ)
+                    dt_to_moscow = dt_to.astimezone(MOSCOW_TZ)
+                    
+                    day_slots.append({
+                        'datetime': dt_from_moscow,
+                        'date': dt_from_moscow.strftime("%d.%m.%Y"),
+                        'weekday': ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"][dt_from_moscow.weekday()],
+                        'weekday_num': dt_from_moscow.weekday(),
+                        'start': dt_from_moscow.strftime("%H:%M"),
+                        'end': dt_to_moscow.strftime("%H:%M"),
+                        'time': f"{dt_from_moscow.strftime('%H:%M')}-{dt_to_moscow.strftime('%H:%M')}",
+                        'room': slot.get("roomName", ""),
+                        'price': slot.get("price", {}).get("from", 0),
+                        'duration_minutes': self.parse_duration(duration),
+                        'unique_key': f"{dt_from_moscow.strftime('%Y%m%d%H%M')}|{slot.get('roomName', '')}"
+                    })
+                except Exception as e:
+                    continue
+        
+        return day_slots
+
+    def _refresh_day(self, venue_key: str, date_str: str, current_time: float):
+        """Обновляем одну дату площадки и учитываем изменения слотов"""
+        venue_id = self.venues[venue_key]['id']
+        key = (venue_key, date_str)
+        previous = self._day_cache.get(key)
+        
+        raw_slots = self.fetch_slots_from_api(venue_id, date_str)
+        if raw_slots is None:
+            # Ошибка API: оставляем прежние данные и не долбим сервер до следующего TTL
+            with self._lock:
+                self._day_cache[key] = {
+                    'slots': previous['slots'] if previous else [],
+                    'timestamp': current_time
+                }
+            return
         
-        # Собираем данные за весь период
-        for day_offset in range(total_days + 1):
-            current_date = start_date + timedelta(days=day_offset)
-            date_str = current_date.strftime("%Y-%m-%d")
-            raw_slots = self.fetch_slots_from_api(venue_id, date_str)
+        slots = self.parse_day_slots(raw_slots)
+        with self._lock:
+            self._scheduler(venue_key).record(venue_key, date_str, previous['slots'] if previous else None,
+                                              slots, current_time)
+            self._day_cache[key] = {'slots': slots, 'timestamp': current_time}
+        # У истории своя блокировка: пока она занята, парсер остается доступен
+        if self.history is not None:
+            self.history.record_snapshot(venue_key, date_str, slots, current_time)
+
+    def build_free_blocks(self, slots: List[Dict]) -> Dict[Tuple[str, str], FreeBlocks]:
+        """Сливаем слоты в максимальные свободные интервалы по (дата, зал)"""
+        by_room: Dict[Tuple[str, str], List[Tuple[int, int, float]]] = {}
+        seen_keys: Set[str] = set()
+        
+        for slot in slots:
+            # 1. Убираем дубликаты (один и тот же слот одного зала)
+            if slot['unique_key'] in seen_keys:
+                continue
+            seen_keys.add(slot['unique_key'])
             
-            for slot_group in raw_slots:
-                for slot in slot_group:
-                    try:
-                        time_from = slot.get("timeFrom", "")
-                        time_to = slot.get("timeTo", "")
-                        duration = slot.get("availableDuration", "PT30M")
-                        
-                        dt_from = datetime.fromisoformat(time_from.replace('Z', '+00:00'))
-                        dt_to = datetime.fromisoformat(time_to.replace('Z', '+00:00'))
-                        
-                        # Конвертируем в московское время
-                        dt_from_moscow = dt_from.astimezone(MOSCOW_TZ)
-                        dt_to_moscow = dt_to.astimezone(MOSCOW_TZ)
-                        
-                        all_slots.append({
-                            'datetime': dt_from_moscow,
-                            'date': dt_from_moscow.strftime("%d.%m.%Y"),
-                            'weekday': ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"][dt_from_moscow.weekday()],
-                            'weekday_num': dt_from_moscow.weekday(),
-                            'start': dt_from_moscow.strftime("%H:%M"),
-                            'end': dt_to_moscow.strftime("%H:%M"),
-                            'time': f"{dt_from_moscow.strftime('%H:%M')}-{dt_to_moscow.strftime('%H:%M')}",
-                            'room': slot.get("roomName", ""),
-                            'price': slot.get("price", {}).get("from", 0),
-                            'duration_minutes': self.parse_duration(duration),
-                            'unique_key': f"{dt_from_moscow.strftime('%Y%m%d%H%M')}"
-                        })
-                    except Exception as e:
-                        continue
+            # 2. Интервал в минутах от начала суток: слот свободен до timeTo
+            # и на всю доступную длительность от начала
+            start_minutes = int(slot['start'][:2]) * 60 + int(slot['start'][3:5])
+            end_minutes = int(slot['end'][:2]) * 60 + int(slot['end'][3:5])
+            if end_minutes <= start_minutes:
+                end_minutes += 24 * 60  # Слот заканчивается после полуночи
+            end_minutes = max(end_minutes, start_minutes + slot['duration_minutes'])
+            
+            date_str = slot['datetime'].strftime("%Y-%m-%d")
+            by_room.setdefault((date_str, slot['room']), []).append(
+                (start_minutes, min(end_minutes, 24 * 60), slot['price'])
+            )
         
-        return self.filter_slots_intelligently(all_slots)
+        return {key: FreeBlocks(intervals) for key, intervals in by_room.items()}
 
     def filter_slots_intelligently(self, slots: List[Dict]) -> List[Dict]:
-        """Умная фильтрация слотов по правилам FFC"""
+        """Умная фильтрация: свободные интервалы каждого зала в окне FILTER_RULES"""
         if not slots:
             return []
         
-        # 1. Убираем дубликаты
-        unique_slots = []
-        seen_keys: Set[str] = set()
-        for slot in slots:
-            key = slot['unique_key']
-            if key not in seen_keys:
-                seen_keys.add(key)
-                unique_slots.append(slot)
-        
-        # 2. Сортируем по дате и времени
-        unique_slots.sort(key=lambda x: (x['date'], x['start']))
+        # 1-2. Сливаем соседние и пересекающиеся слоты каждого зала в интервалы
+        free_blocks = self.build_free_blocks(slots)
         
-        # 3. Фильтруем слоты с duration=PT30M после слотов с большей длительностью
-        filtered_by_duration = []
-        i = 0
-        n = len(unique_slots)
-        
-        while i < n:
-            current_slot = unique_slots[i]
+        # 3. ОБРЕЗАЕМ ИНТЕРВАЛЫ ОКНОМ ФИЛЬТРАЦИИ
+        final_slots = []
+        for (date_str, room), blocks in free_blocks.items():
+            day_start = MOSCOW_TZ.localize(datetime.strptime(date_str, "%Y-%m-%d"))
+            weekday_num = day_start.weekday()
+            rules = FILTER_RULES['weekday' if weekday_num < 5 else 'weekend']
             
-            # Пропускаем слоты, которые являются продолжением предыдущего
-            if i + 1 < n:
-                next_slot = unique_slots[i + 1]
-                if (next_slot['date'] == current_slot['date'] and 
-                    next_slot['start'] == current_slot['end'] and
-                    current_slot['duration_minutes'] > 30 and 
-                    next_slot['duration_minutes'] == 30):
-                    i += 1  # Пропускаем следующий слот
+            for block_start, block_end, price in blocks.blocks_in_window(
+                    rules['start_minutes'], rules['end_minutes'], FREE_BLOCK_MIN_MINUTES):
+                block_dt = day_start + timedelta(minutes=block_start)
+                final_slots.append({
+                    'date': block_dt.strftime("%d.%m.%Y"),
+                    'weekday': ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"][weekday_num],
+                    'time': f"{format_minutes(block_start)}-{format_minutes(block_end)}",
+                    'price': format_block_price(price),
+                    'datetime': block_dt,
+                    'duration_minutes': block_end - block_start,
+                    'room': room
+                })
+        
+        # 4. Сортируем по времени начала, затем по залу
+        final_slots.sort(key=lambda x: (x['datetime'], x['room']))
+        return final_slots
+
+    def find_free_blocks(self, min_minutes: int, window_start: int, window_end: int,
+                         day_type: Optional[str] = None) -> Iterator[Tuple[str, Dict]]:
+        """
+        Ищем в каждом (площадка, зал, дата) самый ранний свободный интервал
+        длиной от min_minutes внутри окна [window_start, window_end).
+        Отдает (название площадки, интервал) по возрастанию времени начала:
+        даты каждой площадки обходятся по порядку, площадки сливаются лениво.
+        """
+        now = datetime.now(MOSCOW_TZ)
+        with self._lock:
+            free_blocks = dict(self._free_blocks)
+        
+        def venue_stream(venue_key: str, venue_blocks: Dict[Tuple[str, str], FreeBlocks]):
+            by_date: Dict[str, List[Tuple[str, FreeBlocks]]] = {}
+            for (date_str, room), blocks in venue_blocks.items():
+                by_date.setdefault(date_str, []).append((room, blocks))
             
-            filtered_by_duration.append(current_slot)
-            i += 1
+            for date_str in sorted(by_date):
+                day_start = MOSCOW_TZ.localize(datetime.strptime(date_str, "%Y-%m-%d"))
+                if day_start.date() < now.date():
+                    continue
+                is_weekday = day_start.weekday() < 5
+                if day_type == 'weekday' and not is_weekday or day_type == 'weekend' and is_weekday:
+                    continue
+                
+                # Сегодня окно начинается не раньше текущего времени
+                effective_start = window_start
+                if day_start.date() == now.date():
+                    effective_start = max(window_start, now.hour * 60 + now.minute)
+                
+                # Интервалы одной даты не выходят за ее сутки — достаточно отсортировать залы
+                day_found = []
+                for room, blocks in by_date[date_str]:
+                    block = blocks.find_block(min_minutes, effective_start, window_end)
+                    if block is None:
+                        continue
+                    block_start, block_end, price = block
+                    block_dt = day_start + timedelta(minutes=block_start)
+                    day_found.append((self.venues[venue_key]['name'], {
+                        'date': block_dt.strftime("%d.%m.%Y"),
+                        'weekday': ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"][block_dt.weekday()],
+                        'time': f"{format_minutes(block_start)}-{format_minutes(block_end)}",
+                        'price': format_block_price(price),
+                        'datetime': block_dt,
+                        'duration_minutes': block_end - block_start,
+                        'room': room
+                    }))
+                day_found.sort(key=lambda item: (item[1]['datetime'], item[1]['room']))
+                yield from day_found
+        
+        streams = [venue_stream(venue_key, venue_blocks) for venue_key, venue_blocks in free_blocks.items()]
+        return heapq.merge(*streams, key=lambda item: (item[1]['datetime'], item[1]['room']))
+
+    def next_free_blocks(self, limit: int, min_minutes: int, window_start: int, window_end: int,
+                         day_type: Optional[str] = None) -> List[Tuple[str, Dict]]:
+        """Первые limit интервалов из find_free_blocks — для вызова через run_parser"""
+        return list(islice(self.find_free_blocks(min_minutes, window_start, window_end, day_type), limit))
+
+    def build_venue_result(self, venue_key: str, keys: List[Tuple[str, str]]) -> Dict:
+        """Собираем отфильтрованные слоты одной площадки из кэша дат"""
+        venue_info = self.venues[venue_key]
+        try:
+            with self._lock:
+                day_slots = []
+                for key in keys:
+                    if key[0] == venue_key and key in self._day_cache:
+                        day_slots.extend(self._day_cache[key]['slots'])
+            slots = self.filter_slots_intelligently(day_slots)
+            # Индекс интервалов без окна фильтрации — для запросов с любым временем
+            free_blocks = self.build_free_blocks(day_slots)
+            with self._lock:
+                self._free_blocks[venue_key] = free_blocks
+            return {
+                'name': venue_info['name'],
+                'slots': slots,
+                'count': len(slots)
+            }
+        except Exception as e:
+            logger.error(f"Ошибка для {venue_info['name']}: {e}")
+            return {'name': venue_info['name'], 'slots': [], 'count': 0}
+
+    def build_results(self, keys: List[Tuple[str, str]]) -> Dict:
+        """Собираем отфильтрованные слоты по площадкам из кэша дат"""
+        return {venue_key: self.build_venue_result(venue_key, keys) for venue_key in self.venues}
+
+    def _cleanup(self, keys: List[Tuple[str, str]], current_time: float):
+        """Забываем даты, которые вышли из периода поиска (вызывать под self._lock)"""
+        active_keys = set(keys)
+        self._day_cache = {key: entry for key, entry in self._day_cache.items() if key in active_keys}
+        for scheduler in self.schedulers.values():
+            scheduler.forget(active_keys)
+
+    def get_venue_slots(self, venue_key: str) -> Dict:
+        """Получаем слоты одной площадки; площадки обновляются независимо друг от друга"""
+        from time import time
         
-        # 4. ФИЛЬТРАЦИЯ ПО ВРЕМЕНИ НАЧАЛА И ОКОНЧАНИЯ
-        final_slots = []
-        for slot in filtered_by_duration:
-            is_weekday = slot['weekday_num'] < 5  # Пн-Пт
+        with self._venue_locks[venue_key]:
+            current_time = time()
+            keys = self._search_keys()
+            with self._lock:
+                stale_keys = [key for key in self._stale_keys(keys, current_time) if key[0] == venue_key]
+                cached = self._cache['data']
+            
+            # Проверяем кэш
+            if not stale_keys and cached is not None and venue_key in cached:
+                return cached[venue_key]
             
-            # Получаем правила фильтрации
-            rules = FILTER_RULES['weekday' if is_weekday else 'weekend']
+            venue_name = self.venues[venue_key]['name']
+            logger.info(f"🔄 {venue_name}: запрашиваем {len(stale_keys)} дат у FFC API...")
             
-            # Преобразуем время начала и окончания в минуты
-            start_hours, start_minutes = map(int, slot['start'].split(':'))
-            end_hours, end_minutes = map(int, slot['end'].split(':'))
+            # Обновляем только устаревшие даты — параллельно в пуле сети площадки
+            self.fetcher.map(self.venues[venue_key]['tenant'], self._refresh_day,
+                             [(venue_key, date_str, current_time) for _, date_str in stale_keys])
             
-            start_total_minutes = start_hours * 60 + start_minutes
-            end_total_minutes = end_hours * 60 + end_minutes
+            venue_result = self.build_venue_result(venue_key, keys)
             
-            # Проверяем по новым правилам:
-            # 1. Слот должен начинаться НЕ РАНЬШЕ start_minutes
-            # 2. Слот должен заканчиваться НЕ ПОЗЖЕ end_minutes
-            if (start_total_minutes >= rules['start_minutes'] and 
-                end_total_minutes <= rules['end_minutes']):
-                final_slots.append(slot)
-        
-        # 5. Форматируем результат
-        return [{
-            'date': slot['date'],
-            'weekday': slot['weekday'],
-            'time': slot['time'],
-            'price': f"{int(slot['price']):,} руб.".replace(',', ' ')
-        } for slot in final_slots]
+            # Обновляем кэш, сохраняя порядок площадок
+            with self._lock:
+                data = dict(self._cache['data'] or {})
+                data[venue_key] = venue_result
+                self._cache['data'] = {key: data[key] for key in self.venues if key in data}
+                self._cache['timestamp'] = current_time
+                self._cache['generation'] += 1
+                self._cleanup(keys, current_time)
+            
+            # Сворачивание и запись истории на диск — вне блокировки парсера
+            if self.history is not None:
+                self.history.compact(current_time)
+                self.history.save()
+            
+            logger.info(f"✅ {venue_name}: кэш обновлен, найдено слотов: {venue_result['count']}")
+            return venue_result
 
     def get_all_venues_slots(self) -> Dict:
-        """Получаем слоты для всех площадок с кэшированием"""
+        """Получаем слоты для всех площадок с адаптивным кэшированием по датам"""
+        for venue_key in self.venues:
+            self.get_venue_slots(venue_key)
+        return self._cache['data']
+
+    def get_week_dates(self, week_offset: int) -> List[str]:
+        """Даты недели (Пн-Вс) со сдвигом week_offset от текущей"""
+        today = datetime.now(MOSCOW_TZ)
+        monday = today - timedelta(days=today.weekday()) + timedelta(weeks=week_offset)
+        return [(monday + timedelta(days=offset)).strftime("%Y-%m-%d") for offset in range(7)]
+
+    def get_far_venue_slots(self, venue_key: str, week_offset: int) -> Dict:
+        """Слоты площадки на дальнюю неделю: загружаются только по запросу и живут в LRU-кэше"""
+        dates = self.get_week_dates(week_offset)
+        page_key = (venue_key, dates[0])
+        
+        # Своя блокировка у каждой страницы: дальняя неделя не задерживает ближнее окно
+        with self._lock:
+            page_lock = self._far_locks.setdefault(page_key, [threading.Lock(), 0])
+            page_lock[1] += 1
+        try:
+            with page_lock[0]:
+                return self._load_far_page(venue_key, dates, page_key)
+        finally:
+            # Блокировку убираем, только когда ее никто не держит и не ждет
+            with self._lock:
+                page_lock[1] -= 1
+                if not page_lock[1]:
+                    del self._far_locks[page_key]
+
+    def _load_far_page(self, venue_key: str, dates: List[str], page_key: Tuple[str, str]) -> Dict:
+        """Берем дальнюю неделю из LRU-кэша или загружаем ее (вызывать под блокировкой страницы)"""
         from time import time
         
-        # Проверяем кэш
-        if self._is_cache_valid():
-            logger.info("📦 Используются кэшированные данные (парсинг не требуется)")
-            # Обновляем timestamp кэша для отображения актуального времени
-            self._cache['timestamp'] = time()
-            return self._cache['data']
-        
-        logger.info("🔄 Обновление кэша: парсим данные с FFC API...")
-        
-        # Парсим свежие данные
-        results = {}
-        for venue_key, venue_info in self.venues.items():
-            try:
-                slots = self.parse_all_slots(venue_info['id'])
-                results[venue_key] = {
-                    'name': venue_info['name'],
-                    'slots': slots,
-                    'count': len(slots)
-                }
-            except Exception as e:
-                logger.error(f"Ошибка для {venue_info['name']}: {e}")
-                results[venue_key] = {'name': venue_info['name'], 'slots': [], 'count': 0}
+        with self._lock:
+            page = self._far_pages.get(page_key)
+            if page is not None and time() - page['timestamp'] < page['ttl']:
+                self._far_pages.move_to_end(page_key)
+                return page['result']
+        
+        venue_info = self.venues[venue_key]
+        logger.info(f"🔭 {venue_info['name']}: загружаем неделю с {dates[0]} по запросу")
+        with self._lock:
+            self._scheduler(venue_key).note_requests(len(dates), time())
+        
+        day_slots = []
+        errors = 0
+        raw_days = self.fetcher.map(venue_info['tenant'], self.fetch_slots_from_api,
+                                    [(venue_info['id'], date_str) for date_str in dates],
+                                    background=True)
+        for raw_slots in raw_days:
+            if raw_slots is None:
+                errors += 1
+                continue
+            day_slots.extend(self.parse_day_slots(raw_slots))
         
-        # Обновляем кэш
-        self._cache['data'] = results
-        self._cache['timestamp'] = time()
+        slots = self.filter_slots_intelligently(day_slots)
+        result = {'name': venue_info['name'], 'slots': slots, 'count': len(slots)}
         
-        logger.info(f"✅ Кэш обновлен. Найдено слотов: {sum(v['count'] for v in results.values())}")
-        return results
+        with self._lock:
+            self._far_pages[page_key] = {
+                'result': result,
+                'timestamp': time(),
+                # Неполную неделю (были ошибки API) перезапрашиваем раньше
+                'ttl': REFRESH_MIN_TTL if errors else FAR_PAGE_TTL
+            }
+            self._far_pages.move_to_end(page_key)
+            while len(self._far_pages) > FAR_CACHE_PAGES:
+                self._far_pages.popitem(last=False)
+        return result
+
+    def get_week_venue_slots(self, venue_key: str, week_offset: int) -> Dict:
+        """Слоты площадки: 0 — ближнее окно, от NEAR_WEEKS — дальняя неделя"""
+        if week_offset < NEAR_WEEKS:
+            return self.get_venue_slots(venue_key)
+        return self.get_far_venue_slots(venue_key, week_offset)
+
+    def get_week_slots(self, week_offset: int) -> Dict:
+        """Слоты всех площадок для ближнего окна или дальней недели"""
+        return {venue_key: self.get_week_venue_slots(venue_key, week_offset) for venue_key in self.venues}
+
+    def get_cached_week_slots(self, week_offset: int) -> Optional[Dict]:
+        """Последние загруженные слоты всех площадок без запросов к API (None — если их нет)"""
+        if week_offset < NEAR_WEEKS:
+            data = self.get_cache_snapshot()[2]
+            if data is None or any(venue_key not in data for venue_key in self.venues):
+                return None
+            return data
+        
+        monday = self.get_week_dates(week_offset)[0]
+        with self._lock:
+            pages = {venue_key: self._far_pages.get((venue_key, monday)) for venue_key in self.venues}
+        if any(page is None for page in pages.values()):
+            return None
+        return {venue_key: page['result'] for venue_key, page in pages.items()}
+
+    def get_cache_snapshot(self) -> Tuple[int, Optional[float], Optional[Dict]]:
+        """Согласованный снимок кэша: (номер обновления, время, данные)"""
+        with self._lock:
+            return self._cache['generation'], self._cache['timestamp'], self._cache['data']
 
     def get_cache_info(self) -> Dict:
         """Получаем информацию о кэше для отображения в примечании"""
@@ -607,9 +1938,273 @@ class FFCParser:
             'is_fresh': is_fresh,
             'last_update': last_update_dt.strftime("%H:%M"),
             'is_cached': self._cache['data'] is not None,
-            'current_time': datetime.now(MOSCOW_TZ).strftime("%H:%M")
+            'generation': self._cache['generation'],
+            'current_time': datetime.now(MOSCOW_TZ).strftime("%H:%M"),
+            'tenants': self.fetcher.get_stats()
+        }
+
+# ===================== ОГРАНИЧЕНИЕ ЧАСТОТЫ ЗАПРОСОВ =====================
+# Сколько /slots подряд можно отправить и как быстро восстанавливается запас
+THROTTLE_CAPACITY = 3
+THROTTLE_REFILL_SECONDS = 20  # Один запрос каждые 20 секунд
+
+class RequestThrottler:
+    """
+    Ограничение частоты тяжелых команд для каждого пользователя.
+    Token bucket: у пользователя есть запас запросов, который пополняется
+    со временем. Повторный запрос, пока предыдущий еще выполняется,
+    присоединяется к нему вместо запуска нового.
+    """
+
+    def __init__(self, capacity: int = THROTTLE_CAPACITY, refill_seconds: float = THROTTLE_REFILL_SECONDS):
+        self.capacity = capacity
+        self.refill_seconds = refill_seconds
+        # user_id -> [запас токенов, время последнего пересчета]
+        self._buckets: Dict[int, List[float]] = {}
+        # user_id -> выполняющийся запрос
+        self._in_flight: Dict[int, asyncio.Task] = {}
+
+    def _prune(self, now: float):
+        """Забываем пользователей, чей запас уже полностью восстановился"""
+        full_after = self.capacity * self.refill_seconds
+        self._buckets = {user_id: bucket for user_id, bucket in self._buckets.items()
+                         if now - bucket[1] < full_after}
+
+    def allow(self, user_id: int) -> bool:
+        """Списываем токен, если он есть"""
+        from time import monotonic
+        now = monotonic()
+        if len(self._buckets) > 1000:
+            self._prune(now)
+
+        tokens, updated = self._buckets.get(user_id, [self.capacity, now])
+        tokens = min(self.capacity, tokens + (now - updated) / self.refill_seconds)
+        allowed = tokens >= 1
+        self._buckets[user_id] = [tokens - 1 if allowed else tokens, now]
+        return allowed
+
+    def retry_after(self, user_id: int) -> int:
+        """Через сколько секунд у пользователя появится токен"""
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            return 0
+        return max(1, int((1 - bucket[0]) * self.refill_seconds))
+
+    def in_flight(self, user_id: int) -> Optional[asyncio.Task]:
+        """Выполняющийся запрос пользователя, если он есть"""
+        task = self._in_flight.get(user_id)
+        if task is not None and task.done():
+            return None
+        return task
+
+    def track(self, user_id: int, task: asyncio.Task):
+        """Запоминаем запрос пользователя как выполняющийся до его завершения"""
+        self._in_flight[user_id] = task
+
+        def _forget(done_task: asyncio.Task):
+            if self._in_flight.get(user_id) is done_task:
+                del self._in_flight[user_id]
+
+        task.add_done_callback(_forget)
+
+# ===================== ПОСТРАНИЧНЫЙ ПРОСМОТР СЛОТОВ =====================
+SLOTS_CALLBACK_PREFIX = "slots"
+SLOTS_REFRESH_FLAG = "r"  # Отметка кнопки "Обновить" в callback_data
+# Не чаще одной промежуточной правки сообщения за столько секунд (лимиты Telegram)
+PROGRESS_EDIT_INTERVAL = 1.5
+# Сколько ближайших слотов площадки показываем, пока грузятся остальные
+PROGRESS_PREVIEW_SLOTS = 5
+
+def room_suffix(slot: Dict) -> str:
+    """Название зала после слота, если API его вернуло"""
+    return f" · {slot['room']}" if slot.get('room') else ""
+
+def group_slots_by_day(slots: List[Dict]) -> List[Tuple[str, str, List[Dict]]]:
+    """Группируем отсортированные слоты по дням: (дата, день недели, слоты)"""
+    days = []
+    for slot in slots:
+        if not days or days[-1][0] != slot['date']:
+            days.append((slot['date'], slot['weekday'], []))
+        days[-1][2].append(slot)
+    return days
+
+def parse_week_arg(args: List[str]) -> int:
+    """Разбираем сдвиг недели для /slots: week+3, неделя+3 или +3"""
+    for arg in args:
+        match = re.fullmatch(r'(?:week|неделя)?\+(\d+)', arg.strip().lower())
+        if match:
+            week_offset = min(int(match.group(1)), FAR_MAX_WEEKS)
+            return week_offset if week_offset >= NEAR_WEEKS else 0
+    return 0
+
+def week_label(week_offset: int) -> str:
+    """Подпись дальней недели: Неделя +3 (dd.mm–dd.mm)"""
+    today = datetime.now(MOSCOW_TZ)
+    monday = today - timedelta(days=today.weekday()) + timedelta(weeks=week_offset)
+    sunday = monday + timedelta(days=6)
+    return f"Неделя +{week_offset} ({monday.strftime('%d.%m')}–{sunday.strftime('%d.%m')})"
+
+def render_slots_page(results: Dict, venue_key: Optional[str], day_index: int,
+                      week_offset: int = 0) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """Рендерим одну страницу (площадка + день) и клавиатуру для листания"""
+    venues_with_slots = [key for key, venue_data in results.items() if venue_data['slots']]
+    
+    def page_button(text: str, target_venue: str, target_day: int,
+                    target_week: int = week_offset, refresh: bool = False) -> InlineKeyboardButton:
+        # Листание рисуется из кэша; только кнопка "Обновить" помечена ":r" и идет в API
+        suffix = f":{SLOTS_REFRESH_FLAG}" if refresh else ""
+        return InlineKeyboardButton(
+            text, callback_data=f"{SLOTS_CALLBACK_PREFIX}:{target_venue}:{target_day}:{target_week}{suffix}"
+        )
+    
+    # Переход между ближним окном и дальними неделями
+    week_row = []
+    if week_offset:
+        previous_week = week_offset - 1 if week_offset > NEAR_WEEKS else 0
+        week_row.append(page_button("⏪ Раньше", venue_key or "-", 0, previous_week))
+    if week_offset < FAR_MAX_WEEKS:
+        next_week = week_offset + 1 if week_offset else NEAR_WEEKS
+        week_row.append(page_button("Дальше ⏩", venue_key or "-", 0, next_week))
+    
+    if not venues_with_slots:
+        period = f"{week_label(week_offset)}:" if week_offset else "На ближайшие 2 недели"
+        text = (
+            f"🎯 *{period} свободных слотов не найдено.*\n\n"
+            "_Попробуйте изменить параметры поиска или проверьте позже._"
+        )
+        return text, InlineKeyboardMarkup([week_row]) if week_row else None
+    
+    if venue_key not in venues_with_slots:
+        venue_key = venues_with_slots[0]
+    venue_data = results[venue_key]
+    days = group_slots_by_day(venue_data['slots'])
+    day_index = min(max(day_index, 0), len(days) - 1)
+    date_str, weekday, day_slots = days[day_index]
+    
+    total_slots_found = sum(results[key]['count'] for key in venues_with_slots)
+    now_moscow = datetime.now(MOSCOW_TZ)
+    
+    lines = [
+        "⚽ *СВОБОДНЫЕ СЛОТЫ FFC.TEAM*",
+        f"_Найдено {total_slots_found} слотов_" + (f" — {week_label(week_offset)}" if week_offset else ""),
+        "",
+        f"🏟️ *{venue_data['name']}* — {venue_data['count']} слотов",
+        f"📅 *{date_str}* ({weekday}):"
+    ]
+    for slot in day_slots:
+        lines.append(f"• {slot['time']} — {slot['price']}{room_suffix(slot)}")
+    lines.extend([
+        "",
+        f"_Данные актуальны на {now_moscow.strftime('%H:%M')} ({now_moscow.strftime('%d.%m.%Y')})_",
+        "_Будни: 18:30–22:30, выходные: 08:30–21:30_"
+    ])
+    
+    keyboard = []
+    if len(venues_with_slots) > 1:
+        keyboard.append([
+            page_button(("✅ " if key == venue_key else "") + results[key]['name'], key, 0)
+            for key in venues_with_slots
+        ])
+    keyboard.append([
+        page_button("◀️", venue_key, (day_index - 1) % len(days)),
+        page_button(f"{date_str[:5]} ({day_index + 1}/{len(days)})", venue_key, day_index),
+        page_button("▶️", venue_key, (day_index + 1) % len(days))
+    ])
+    keyboard.append([page_button("🔄 Обновить", venue_key, day_index, refresh=True)])
+    if week_row:
+        keyboard.append(week_row)
+    
+    return "\n".join(lines), InlineKeyboardMarkup(keyboard)
+
+def render_slots_progress(ready: Dict, venues: Dict) -> str:
+    """Промежуточное сообщение: блоки готовых площадок, остальные — в загрузке"""
+    lines = [f"🔍 *Ищу свободные слоты...* ({len(ready)}/{len(venues)} площадок)"]
+    for venue_key, venue_info in venues.items():
+        lines.append("")
+        venue_data = ready.get(venue_key)
+        if venue_data is None:
+            lines.append(f"⏳ {venue_info['name']} — загрузка...")
+            continue
+        lines.append(f"🏟️ *{venue_data['name']}* — {venue_data['count']} слотов")
+        for slot in venue_data['slots'][:PROGRESS_PREVIEW_SLOTS]:
+            lines.append(f"• {slot['date'][:5]} ({slot['weekday']}) {slot['time']} — {slot['price']}{room_suffix(slot)}")
+    return "\n".join(lines)
+
+# ===================== БЛИЖАЙШИЕ СЛОТЫ =====================
+NEXT_DEFAULT_RESULTS = 5
+NEXT_MAX_RESULTS = 20
+
+def iter_next_slots(results: Dict, now: datetime, min_duration: int = 0,
+                    day_type: Optional[str] = None) -> Iterator[Tuple[str, Dict]]:
+    """
+    Ленивое k-way слияние отсортированных списков слотов всех площадок.
+    Отдает пары (название площадки, слот) по возрастанию времени начала,
+    не собирая общий список целиком.
+    """
+    # Уже идущие интервалы показываем с ближайшей минуты
+    current_minute = now.replace(second=0, microsecond=0)
+    if current_minute < now:
+        current_minute += timedelta(minutes=1)
+
+    def clip_to_now(slot: Dict) -> Optional[Dict]:
+        skipped = int((current_minute - slot['datetime']).total_seconds() // 60)
+        remaining = slot['duration_minutes'] - skipped
+        if remaining < max(min_duration, FREE_BLOCK_MIN_MINUTES):
+            return None
+        start_minutes = current_minute.hour * 60 + current_minute.minute
+        return {
+            **slot,
+            'time': f"{format_minutes(start_minutes)}-{format_minutes(start_minutes + remaining)}",
+            'datetime': current_minute,
+            'duration_minutes': remaining
         }
 
+    def venue_stream(venue_data: Dict):
+        for slot in venue_data['slots']:
+            if slot['datetime'] < now:
+                slot = clip_to_now(slot)
+                if slot is None:
+                    continue
+            elif slot['duration_minutes'] < min_duration:
+                continue
+            is_weekday = slot['datetime'].weekday() < 5
+            if day_type == 'weekday' and not is_weekday or day_type == 'weekend' and is_weekday:
+                continue
+            yield venue_data['name'], slot
+
+    streams = [venue_stream(venue_data) for venue_data in results.values()]
+    return heapq.merge(*streams, key=lambda item: item[1]['datetime'])
+
+def find_next_slots(results: Dict, limit: int, min_duration: int = 0,
+                    day_type: Optional[str] = None) -> List[Tuple[str, Dict]]:
+    """Первые limit слотов по всем площадкам"""
+    now = datetime.now(MOSCOW_TZ)
+    return list(islice(iter_next_slots(results, now, min_duration, day_type), limit))
+
+def parse_next_args(args: List[str]) -> Tuple[int, int, Optional[str], Optional[Tuple[int, int]]]:
+    """Разбираем аргументы /next: количество, минимальная длительность, будни/выходные, окно"""
+    limit = NEXT_DEFAULT_RESULTS
+    min_duration = 0
+    day_type = None
+    window = None
+    for arg in args:
+        arg_clean = arg.strip().lower()
+        duration_match = re.fullmatch(r'(\d+(?:[.,]\d+)?)(м|мин|min|m|ч|h)', arg_clean)
+        window_match = re.fullmatch(r'(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})', arg_clean)
+        if window_match:
+            start_h, start_m, end_h, end_m = map(int, window_match.groups())
+            window = (start_h * 60 + start_m, end_h * 60 + end_m)
+        elif arg_clean.isdigit():
+            limit = min(max(int(arg_clean), 1), NEXT_MAX_RESULTS)
+        elif duration_match:
+            value = float(duration_match.group(1).replace(',', '.'))
+            min_duration = int(value * 60 if duration_match.group(2) in ('ч', 'h') else value)
+        elif arg_clean in ('будни', 'weekday'):
+            day_type = 'weekday'
+        elif arg_clean in ('выходные', 'weekend'):
+            day_type = 'weekend'
+    return limit, min_duration, day_type, window
+
 # ===================== КОМАНДЫ ТЕЛЕГРАМ-БОТА =====================
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -617,14 +2212,15 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     
     # Логируем пользователя и команду
-    statistics.add_user(user.id, user.username, user.first_name)
-    statistics.log_command(user.id, 'start')
+    await run_blocking(statistics.add_user, user.id, user.username, user.first_name)
+    await run_blocking(statistics.log_command, user.id, 'start')
     
     welcome_text = (
         f"Привет, {user.first_name}! 👋\n\n"
         "⚽ *Я — бот для поиска свободных футбольных слотов на FFC.Team*\n\n"
         "📋 *Доступные команды:*\n"
         "• /slots — найти свободные слоты\n"
+        "• /next — ближайшие свободные слоты\n"
         "• /venues — список площадок\n"
         "• /help — помощь\n\n"
         "⚙️ *Автофильтрация:*\n"
@@ -637,7 +2233,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def venues_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /venues"""
     user = update.effective_user
-    statistics.log_command(user.id, 'venues')
+    await run_blocking(statistics.log_command, user.id, 'venues')
     
     text = "🏟️ *ДОСТУПНЫЕ ПЛОЩАДКИ:*\n\n"
     for venue in parser.venues.values():
@@ -648,56 +2244,126 @@ async def venues_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /help"""
     user = update.effective_user
-    statistics.log_command(user.id, 'help')
+    await run_blocking(statistics.log_command, user.id, 'help')
     
     text = (
         "🆘 *ПОМОЩЬ*\n\n"
         "*/slots* — основной поиск слотов на 2 недели вперед\n"
+        "*/slots week+3* — слоты на неделю через 3 недели (до +8)\n"
+        "*/next [N] [90м] [будни|выходные] [19:00-22:30]* — N ближайших свободных интервалов\n"
         "*/venues* — список всех площадок\n"
         "*/start* — это сообщение\n"
-        "*/stats* — статистика (только для админов)\n\n"
+        "*/stats* — статистика (только для админов)\n"
+        "*/history* — история освобождения слотов (только для админов)\n\n"
         "📊 *Как это работает:*\n"
         "1. Бот проверяет доступность слотов на 2 недели\n"
         "2. *Будни (Пн-Пт):* слоты с 18:30 до 22:30\n"
         "3. *Выходные:* слоты с 08:30 до 21:30\n"
         "4. Данные обновляются автоматически\n\n"
-        "📝 *Если слотов слишком много:*\n"
-        "Бот разобьет ответ на несколько сообщений\n\n"
+        "📝 *Листайте результаты кнопками:*\n"
+        "Площадка и день переключаются под сообщением\n\n"
         "❓ Есть вопросы? Обращайтесь к разработчику!"
     )
     await update.message.reply_text(text, parse_mode='Markdown')
 
+def is_admin(user_id: int) -> bool:
+    """Проверяем права админа (если список админов пуст — доступ у всех)"""
+    admin_ids_clean = [id.strip() for id in ADMIN_IDS if id.strip()]
+    return not admin_ids_clean or str(user_id) in admin_ids_clean
+
+async def deny_access(update: Update):
+    """Отвечаем пользователю без прав админа"""
+    await update.message.reply_text(
+        "⛔ *Доступ запрещен*\n\n"
+        "Эта команда доступна только администраторам бота.",
+        parse_mode='Markdown'
+    )
+
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /stats - ТОЛЬКО ДЛЯ АДМИНОВ"""
     user = update.effective_user
     
     # Проверяем права админа
-    admin_ids_clean = [id.strip() for id in ADMIN_IDS if id.strip()]
-    if str(user.id) not in admin_ids_clean and admin_ids_clean:
-        await update.message.reply_text(
-            "⛔ *Доступ запрещен*\n\n"
-            "Эта команда доступна только администраторам бота.",
-            parse_mode='Markdown'
-        )
+    if not is_admin(user.id):
+        await deny_access(update)
         return
     
     # Логируем использование команды
-    statistics.log_command(user.id, 'stats')
+    await run_blocking(statistics.log_command, user.id, 'stats')
     
     # Спрашиваем, какую статистику показать
     if context.args and context.args[0].lower() == 'detail':
-        stats_text = statistics.get_detailed_stats()
+        stats_text = await run_blocking(statistics.get_detailed_stats)
     else:
-        stats_text = statistics.get_stats_summary()
+        stats_text = await run_blocking(statistics.get_stats_summary)
     
     await update.message.reply_text(stats_text, parse_mode='Markdown')
 
+async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /history [день] [ЧЧ:ММ] [площадка] - ТОЛЬКО ДЛЯ АДМИНОВ"""
+    user = update.effective_user
+    
+    if not is_admin(user.id):
+        await deny_access(update)
+        return
+    
+    await run_blocking(statistics.log_command, user.id, 'history')
+    
+    if not context.args:
+        await update.message.reply_text(await run_blocking(history.get_summary), parse_mode='Markdown')
+        return
+    
+    # Разбираем аргументы: день недели, время начала и (необязательно) площадку
+    weekday = None
+    minute = None
+    venue_key = None
+    for arg in context.args:
+        arg_clean = arg.strip().lower()
+        weekday_names = [name.lower() for name in WEEKDAY_NAMES]
+        if arg_clean in weekday_names:
+            weekday = weekday_names.index(arg_clean)
+        elif ':' in arg_clean:
+            try:
+                hours, minutes = map(int, arg_clean.split(':'))
+                minute = hours * 60 + minutes
+            except ValueError:
+                pass
+        elif arg_clean in parser.venues:
+            venue_key = arg_clean
+    
+    if weekday is None or minute is None:
+        await update.message.reply_text(
+            "❓ *Формат:* `/history сб 10:00 [площадка]`\n"
+            f"Площадки: {', '.join(parser.venues)}",
+            parse_mode='Markdown'
+        )
+        return
+    
+    await update.message.reply_text(
+        await run_blocking(history.format_free_ups, weekday, minute, venue_key),
+        parse_mode='Markdown'
+    )
+
 async def slots_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /slots — ГЛАВНАЯ ФУНКЦИЯ (с разбивкой на части)"""
+    """Обработчик команды /slots — ГЛАВНАЯ ФУНКЦИЯ (с защитой от повторных нажатий)"""
     user = update.effective_user
     
+    # Повторный /slots, пока первый еще выполняется, — его результат появится
+    # в сообщении первого запроса, новый поиск не запускаем
+    if throttler.in_flight(user.id) is not None:
+        await run_blocking(statistics.log_throttled, 'deduped')
+        return
+    
+    # Слишком частые запросы получают короткий ответ без поиска
+    if not throttler.allow(user.id):
+        await run_blocking(statistics.log_throttled, 'throttled')
+        await update.message.reply_text(
+            f"⏳ Слишком часто. Повторите через {throttler.retry_after(user.id)} сек."
+        )
+        return
+    
     # Логируем команду
-    statistics.log_command(user.id, 'slots')
+    await run_blocking(statistics.log_command, user.id, 'slots')
     
     # Получаем текущее московское время для отображения
     current_time_moscow = datetime.now(MOSCOW_TZ)
@@ -710,94 +2376,52 @@ async def slots_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode='Markdown'
     )
     
+    # Сам поиск идет отдельной задачей: следующие сообщения этого чата его не ждут
+    week_offset = parse_week_arg(context.args or [])
+    task = context.application.create_task(send_slots(update, message, week_offset), update=update)
+    throttler.track(user.id, task)
+
+async def send_slots(update: Update, message, week_offset: int = 0):
+    """Поиск слотов и показ первой страницы результатов в сообщении о поиске"""
     try:
-        # Получаем все слоты
-        results = parser.get_all_venues_slots()
-        
-        # Логируем найденные слоты в статистику
-        statistics.log_slots_found(results)
+        # Площадки загружаются параллельно; каждую показываем, как только она готова
+        async def load_venue(venue_key: str):
+            return venue_key, await run_parser(parser.get_week_venue_slots, venue_key, week_offset)
+        
+        ready = {}
+        last_edit = 0.0
+        for future in asyncio.as_completed([load_venue(key) for key in parser.venues]):
+            venue_key, venue_data = await future
+            ready[venue_key] = venue_data
+            
+            # Промежуточные правки не чаще раза в PROGRESS_EDIT_INTERVAL секунд
+            now = asyncio.get_running_loop().time()
+            if len(ready) < len(parser.venues) and now - last_edit >= PROGRESS_EDIT_INTERVAL:
+                last_edit = now
+                try:
+                    await message.edit_text(
+                        render_slots_progress(ready, parser.venues), parse_mode='Markdown'
+                    )
+                except BadRequest as e:
+                    logger.warning(f"Не удалось показать промежуточный результат: {e}")
+        
+        results = {key: ready[key] for key in parser.venues}
         
         # Получаем информацию о кэше
         cache_info = parser.get_cache_info()
         
+        # Логируем найденные слоты в статистику (только ближнее окно)
+        if not week_offset:
+            await run_blocking(statistics.log_slots_found, results, cache_info.get('generation'))
+        
         if not results:
             output = "❌ *Не удалось получить данные от сервера FFC.*"
             await message.edit_text(output, parse_mode='Markdown')
             return
         
-        messages = []
-        total_slots_found = 0
-        
-        # Формируем сообщения для каждой площадки
-        for venue_data in results.values():
-            slots = venue_data['slots']
-            if not slots:
-                continue
-            
-            venue_msg = f"🏟️ *{venue_data['name']}*\n"
-            current_date = None
-            slots_in_venue = 0
-            
-            for slot in slots:
-                if slot['date'] != current_date:
-                    current_date = slot['date']
-                    venue_msg += f"\n📅 *{current_date}* ({slot['weekday']}):\n"
-                
-                venue_msg += f"• {slot['time']} — {slot['price']}\n"
-                total_slots_found += 1
-                slots_in_venue += 1
-            
-            venue_msg += f"\nВсего: {slots_in_venue} слотов\n"
-            messages.append(venue_msg)
-        
-        if not messages:
-            output = (
-                "🎯 *На ближайшие 2 недели свободных слотов не найдено.*\n\n"
-                "_Попробуйте изменить параметры поиска или проверьте позже._"
-            )
-            await message.edit_text(output, parse_mode='Markdown')
-            return
-        
-        # Формируем заголовок и примечание
-        header = f"⚽ *СВОБОДНЫЕ СЛОТЫ FFC.TEAM*\n_Найдено {total_slots_found} слотов_\n\n"
-        
-        # СОЗДАЕМ КОРРЕКТНОЕ ПРИМЕЧАНИЕ С АКТУАЛЬНЫМ ВРЕМЕНЕМ
-        now_moscow = datetime.now(MOSCOW_TZ)
-        time_str = now_moscow.strftime("%H:%M")
-        date_str = now_moscow.strftime("%d.%m.%Y")
-        
-        # Определяем источник данных
-        if cache_info['is_cached'] and cache_info['is_fresh']:
-            data_source = "кэшированные данные"
-        else:
-            data_source = "актуальные данные"
-        
-        footer = (
-            f"\n📝 *Примечание:*\n"
-            f"• Данные актуальны на {time_str} ({date_str})\n"
-            f"• Будни (Пн-Пт): показываются слоты с 18:30 до 22:30\n"
-            f"• Выходные: показываются слоты с 08:30 до 21:30\n"
-            f"• Данные обновляются каждые 5 минут\n"
-            f"• Используйте /help для справки"
-        )
-        
-        # Объединяем все части
-        full_output = header + "="*40 + "\n" + "\n".join(messages) + footer
-        
-        # Разбиваем сообщение на части, если оно слишком длинное
-        message_parts = split_message(full_output, max_length=4000)
-        
-        if len(message_parts) == 1:
-            # Если одно сообщение, просто редактируем
-            await message.edit_text(message_parts[0], parse_mode='Markdown')
-        else:
-            # Если несколько частей, первая часть редактирует исходное сообщение
-            await message.edit_text(message_parts[0], parse_mode='Markdown')
-            
-            # Остальные части отправляем новыми сообщениями
-            for i, part in enumerate(message_parts[1:], 2):
-                part_with_counter = f"📄 *Часть {i}/{len(message_parts)}*\n\n{part}"
-                await update.message.reply_text(part_with_counter, parse_mode='Markdown')
+        # Показываем первую страницу: первая площадка со слотами, ближайший день
+        text, keyboard = render_slots_page(results, None, 0, week_offset)
+        await message.edit_text(text, parse_mode='Markdown', reply_markup=keyboard)
         
     except Exception as e:
         logger.error(f"Критическая ошибка в slots_command: {e}")
@@ -811,21 +2435,393 @@ async def slots_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except:
             await update.message.reply_text(error_text, parse_mode='Markdown')
 
+async def next_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /next [N] [90м] [будни|выходные] [19:00-22:30] — ближайшие слоты"""
+    user = update.effective_user
+    await run_blocking(statistics.log_command, user.id, 'next')
+    
+    limit, min_duration, day_type, window = parse_next_args(context.args or [])
+    
+    try:
+        results = await run_parser(parser.get_all_venues_slots)
+        if window:
+            # Окно задано явно — ищем по индексу свободных интервалов, без окна FILTER_RULES
+            next_slots = await run_parser(
+                parser.next_free_blocks, limit,
+                max(min_duration, FREE_BLOCK_MIN_MINUTES), window[0], window[1], day_type
+            )
+        else:
+            next_slots = find_next_slots(results, limit, min_duration, day_type)
+    except Exception as e:
+        logger.error(f"Ошибка в next_command: {e}")
+        await update.message.reply_text(
+            "❌ *Не удалось получить данные от сервера FFC.*", parse_mode='Markdown'
+        )
+        return
+    
+    if not next_slots:
+        await update.message.reply_text(
+            "🎯 *Подходящих свободных слотов не найдено.*", parse_mode='Markdown'
+        )
+        return
+    
+    lines = [f"⏭️ *Ближайшие свободные слоты* ({len(next_slots)}):", ""]
+    for venue_name, slot in next_slots:
+        lines.append(f"• {slot['date'][:5]} ({slot['weekday']}) {slot['time']} — {slot['price']}")
+        lines.append(f"   🏟️ {venue_name}{room_suffix(slot)}")
+    
+    filters = []
+    if min_duration:
+        filters.append(f"от {min_duration} мин")
+    if day_type:
+        filters.append("только будни" if day_type == 'weekday' else "только выходные")
+    if window:
+        filters.append(f"{format_minutes(window[0])}–{format_minutes(window[1])}")
+    if filters:
+        lines.extend(["", f"_Фильтр: {', '.join(filters)}_"])
+    
+    await update.message.reply_text("\n".join(lines), parse_mode='Markdown')
+
+async def slots_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик кнопок листания /slots — редактирует то же сообщение"""
+    query = update.callback_query
+    
+    answer_text = None
+    
+    try:
+        # Кнопки старых сообщений не содержат неделю — это ближнее окно
+        _, venue_key, day_index, *rest = query.data.split(':')
+        week_offset = int(rest[0]) if rest else 0
+        refresh = rest[1:] == [SLOTS_REFRESH_FLAG]
+        
+        # Листание — из уже загруженных данных; в API идем только за "Обновить"
+        # или если эту неделю еще никто не загружал
+        results = None if refresh else parser.get_cached_week_slots(week_offset)
+        if results is None:
+            if refresh and not throttler.allow(query.from_user.id):
+                await run_blocking(statistics.log_throttled, 'throttled')
+                answer_text = f"⏳ Слишком часто. Повторите через {throttler.retry_after(query.from_user.id)} сек."
+            else:
+                results = await run_parser(parser.get_week_slots, week_offset)
+        
+        if results is not None:
+            text, keyboard = render_slots_page(results, venue_key, int(day_index), week_offset)
+            await query.edit_message_text(text, parse_mode='Markdown', reply_markup=keyboard)
+    except BadRequest as e:
+        # Страница не изменилась (например, повторное нажатие "Обновить")
+        if "not modified" not in str(e).lower():
+            logger.error(f"Ошибка при листании слотов: {e}")
+    except Exception as e:
+        logger.error(f"Ошибка при листании слотов: {e}")
+    
+    await query.answer(answer_text)
+
 async def setup_bot_commands(application):
     """Устанавливаем меню команд в Telegram"""
     await application.bot.set_my_commands([
         ("start", "Запустить бота"),
         ("slots", "Найти свободные слоты ⭐"),
+        ("next", "Ближайшие свободные слоты"),
         ("venues", "Список площадок"),
         ("help", "Помощь по использованию"),
     ])
     logger.info("✅ Меню команд Telegram установлено")
 
+# ===================== ЛОКАЛЬНЫЙ HTTP API =====================
+# Адрес JSON API для внутренних сервисов (порт 0 — API выключен)
+API_HOST = os.environ.get("API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("API_PORT", "8081"))
+# Сколько готовых ответов храним для текущего обновления кэша
+API_RESPONSE_CACHE_SIZE = 64
+
+def _split_query_values(query: Dict[str, List[str]], name: str) -> Tuple[str, ...]:
+    """Значения параметра: ?venue=a&venue=b и ?venue=a,b равнозначны"""
+    values = set()
+    for value in query.get(name, []):
+        values.update(part.strip() for part in value.split(',') if part.strip())
+    return tuple(sorted(values))
+
+def serialize_slots(generation: int, timestamp: Optional[float], results: Dict,
+                    venues: Tuple[str, ...], dates: Tuple[str, ...],
+                    date_from: Optional[str], date_to: Optional[str]) -> bytes:
+    """Сериализуем кэш слотов в JSON с учетом фильтров"""
+    payload_venues = {}
+    for venue_key, venue_data in (results or {}).items():
+        if venues and venue_key not in venues:
+            continue
+        slots = []
+        for slot in venue_data['slots']:
+            slot_date = slot['datetime'].strftime("%Y-%m-%d")
+            if dates and slot_date not in dates:
+                continue
+            if date_from and slot_date < date_from or date_to and slot_date > date_to:
+                continue
+            slots.append({
+                'date': slot_date,
+                'weekday': slot['weekday'],
+                'time': slot['time'],
+                'room': slot['room'],
+                'start': slot['datetime'].isoformat(),
+                'duration_minutes': slot['duration_minutes'],
+                'price': slot['price']
+            })
+        payload_venues[venue_key] = {'name': venue_data['name'], 'count': len(slots), 'slots': slots}
+
+    payload = {
+        'generation': generation,
+        'updated_at': datetime.fromtimestamp(timestamp, MOSCOW_TZ).isoformat() if timestamp else None,
+        'venues': payload_venues
+    }
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+class SlotsApiHandler(BaseHTTPRequestHandler):
+    """Только чтение: GET /slots?venue=...&date=ГГГГ-ММ-ДД&date_from=...&date_to=..."""
+
+    server_version = "FFCSlotsAPI/1.0"
+    # Готовые ответы текущего обновления: (номер обновления, запрос) -> (ETag, тело)
+    _responses: Dict[Tuple, Tuple[str, bytes]] = {}
+    _responses_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        logger.debug(f"API {self.address_string()} - {format % args}")
+
+    def _send(self, status: int, body: bytes = b"", etag: Optional[str] = None):
+        self.send_response(status)
+        if etag:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+        if status != 304:
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if status != 304 and self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _etag_matches(self, etag: str) -> bool:
+        header = self.headers.get("If-None-Match")
+        if not header:
+            return False
+        candidates = [value.strip() for value in header.split(',')]
+        return '*' in candidates or etag in candidates
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/health':
+            self._send(200, b'{"status":"ok"}')
+            return
+        if url.path != '/slots':
+            self._send(404, b'{"error":"not found"}')
+            return
+
+        query = parse_qs(url.query)
+        filters = (
+            _split_query_values(query, 'venue'),
+            _split_query_values(query, 'date'),
+            (query.get('date_from') or [None])[0],
+            (query.get('date_to') or [None])[0]
+        )
+
+        try:
+            # Устаревшие даты обновятся через общий кэш бота, свежие берутся как есть
+            parser.get_all_venues_slots()
+            generation, timestamp, results = parser.get_cache_snapshot()
+        except Exception as e:
+            logger.error(f"Ошибка API при получении слотов: {e}")
+            self._send(503, b'{"error":"upstream unavailable"}')
+            return
+
+        response_key = (generation, filters)
+        with self._responses_lock:
+            cached = self._responses.get(response_key)
+        if cached is None:
+            body = serialize_slots(generation, timestamp, results, *filters)
+            # Сильный ETag: номер обновления кэша + хэш времени обновления и фильтров
+            # (время отличает одинаковые номера обновлений после перезапуска бота)
+            digest = sha1(f"{timestamp}|{filters!r}".encode('utf-8')).hexdigest()[:12]
+            cached = (f'"g{generation}-{digest}"', body)
+            with self._responses_lock:
+                # Ответы прошлых обновлений больше не нужны
+                if any(key[0] != generation for key in self._responses) or \
+                        len(self._responses) >= API_RESPONSE_CACHE_SIZE:
+                    self._responses.clear()
+                self._responses[response_key] = cached
+
+        etag, body = cached
+        if self._etag_matches(etag):
+            self._send(304, etag=etag)
+        else:
+            self._send(200, body, etag=etag)
+
+    do_HEAD = do_GET
+
+def start_api_server(host: str = API_HOST, port: int = API_PORT) -> Optional[ThreadingHTTPServer]:
+    """Запускаем JSON API в фоновом потоке"""
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), SlotsApiHandler)
+    except OSError as e:
+        logger.error(f"Не удалось запустить HTTP API на {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="slots-api", daemon=True).start()
+    logger.info(f"🌐 HTTP API слотов: http://{host}:{port}/slots")
+    return server
+
+# ===================== КОНСОЛЬНЫЙ РЕЖИМ (ПРОФИЛИРОВАНИЕ) =====================
+def _fixture_path(fixtures_dir: str, venue_key: str, date_str: str) -> str:
+    return os.path.join(fixtures_dir, f"{venue_key}_{date_str}.json")
+
+def run_pipeline(source: str = 'live', api_base: Optional[str] = None,
+                 fixtures_dir: Optional[str] = None, record_dir: Optional[str] = None,
+                 venue_keys: Optional[List[str]] = None) -> Dict:
+    """
+    Прогоняем fetch -> parse -> filter -> render -> split без Telegram
+    и замеряем время, пиковую память и размер результата каждого этапа.
+    """
+    import tracemalloc
+    from time import perf_counter
+
+    pipeline_parser = FFCParser(api_base=api_base)
+    try:
+        venue_keys = venue_keys or list(pipeline_parser.venues)
+        stages = {}
+
+        def measure(name: str, started: float, **metrics):
+            _, peak = tracemalloc.get_traced_memory()
+            stages[name] = {'seconds': round(perf_counter() - started, 6), 'peak_bytes': peak, **metrics}
+            tracemalloc.reset_peak()
+
+        tracemalloc.start()
+        total_started = perf_counter()
+
+        # 1. FETCH: живой API, мок или записанные ответы
+        started = perf_counter()
+        raw: Dict[Tuple[str, str], Optional[List]] = {}
+        if source == 'fixtures':
+            for file_name in sorted(os.listdir(fixtures_dir)):
+                venue_key, _, date_part = file_name.rpartition('_')
+                if venue_key in venue_keys and file_name.endswith('.json'):
+                    with open(os.path.join(fixtures_dir, file_name), 'r', encoding='utf-8') as f:
+                        raw[(venue_key, date_part[:-5])] = json.load(f)
+        else:
+            # Как и в боте: даты каждой площадки идут через пул ее сети параллельно,
+            # сети обслуживаются планировщиком по очереди
+            futures = {
+                (venue_key, date_str): pipeline_parser.fetcher.submit(
+                    pipeline_parser.venues[venue_key]['tenant'], pipeline_parser.fetch_slots_from_api,
+                    pipeline_parser.venues[venue_key]['id'], date_str
+                )
+                for venue_key, date_str in pipeline_parser._search_keys() if venue_key in venue_keys
+            }
+            raw = {key: future.result() for key, future in futures.items()}
+        measure('fetch', started,
+                requests=len(raw) if source != 'fixtures' else 0,
+                errors=sum(1 for value in raw.values() if value is None),
+                output_bytes=len(json.dumps([value for value in raw.values() if value]).encode('utf-8')))
+
+        if record_dir:
+            os.makedirs(record_dir, exist_ok=True)
+            for (venue_key, date_str), value in raw.items():
+                if value is not None:
+                    with open(_fixture_path(record_dir, venue_key, date_str), 'w', encoding='utf-8') as f:
+                        json.dump(value, f, ensure_ascii=False)
+
+        # 2. PARSE
+        started = perf_counter()
+        parsed: Dict[str, List[Dict]] = {venue_key: [] for venue_key in venue_keys}
+        for (venue_key, _), value in raw.items():
+            if value:
+                parsed[venue_key].extend(pipeline_parser.parse_day_slots(value))
+        measure('parse', started, slots=sum(len(slots) for slots in parsed.values()))
+
+        # 3. FILTER
+        started = perf_counter()
+        results = {}
+        for venue_key, slots in parsed.items():
+            filtered = pipeline_parser.filter_slots_intelligently(slots)
+            results[venue_key] = {
+                'name': pipeline_parser.venues[venue_key]['name'],
+                'slots': filtered,
+                'count': len(filtered)
+            }
+        measure('filter', started, slots=sum(venue['count'] for venue in results.values()))
+
+        # 4. RENDER: все страницы, которые /slots может показать
+        started = perf_counter()
+        pages = []
+        for venue_key, venue_data in results.items():
+            for day_index in range(len(group_slots_by_day(venue_data['slots']))):
+                pages.append(render_slots_page(results, venue_key, day_index)[0])
+        if not pages:
+            pages.append(render_slots_page(results, None, 0)[0])
+        page_sizes = [len(page.encode('utf-8')) for page in pages]
+        measure('render', started, pages=len(pages),
+                output_bytes=sum(page_sizes), max_page_bytes=max(page_sizes))
+
+        # 5. SPLIT: страницы, которые не влезли бы в одно сообщение
+        started = perf_counter()
+        parts = [part for page in pages for part in split_message(page, max_length=4000)]
+        measure('split', started, messages=len(parts),
+                output_bytes=sum(len(part.encode('utf-8')) for part in parts))
+
+        total_seconds = perf_counter() - total_started
+
+        return {
+            'source': source,
+            'api_base': pipeline_parser.api_base if source != 'fixtures' else None,
+            'venues': venue_keys,
+            'dates': len({date_str for _, date_str in raw}),
+            'stages': stages,
+            'total_seconds': round(total_seconds, 6),
+            'peak_bytes': max(stage['peak_bytes'] for stage in stages.values())
+        }
+    finally:
+        tracemalloc.stop()
+        pipeline_parser.fetcher.shutdown()
+
+def pipeline_main(argv: List[str]) -> int:
+    """Точка входа консольного режима: печатает замеры в JSON"""
+    arg_parser = argparse.ArgumentParser(
+        prog="bot.py pipeline",
+        description="Прогон fetch -> parse -> filter -> render -> split без Telegram"
+    )
+    arg_parser.add_argument('--source', choices=['live', 'fixtures'], default='live',
+                            help="live — API (или мок через --api-base), fixtures — записанные ответы")
+    arg_parser.add_argument('--api-base', help="базовый адрес API, например мок-сервера")
+    arg_parser.add_argument('--fixtures', help="каталог с ответами <площадка>_<ГГГГ-ММ-ДД>.json")
+    arg_parser.add_argument('--record', help="записать полученные ответы API в этот каталог")
+    arg_parser.add_argument('--venue', action='append', help="только эта площадка (можно несколько)")
+    args = arg_parser.parse_args(argv)
+
+    if args.source == 'fixtures' and not args.fixtures:
+        arg_parser.error("--source fixtures требует --fixtures")
+    # Площадки те же, что получит парсер: из файла сетей или сети FFC
+    known_venues = [venue_key for config in load_tenants().values() for venue_key in config.get('venues', {})]
+    unknown_venues = [venue_key for venue_key in args.venue or [] if venue_key not in known_venues]
+    if unknown_venues:
+        arg_parser.error(f"неизвестные площадки: {', '.join(unknown_venues)} "
+                         f"(доступны: {', '.join(known_venues)})")
+
+    report = run_pipeline(args.source, args.api_base, args.fixtures, args.record, args.venue)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+# ===================== ПЛАНОВОЕ ОБСЛУЖИВАНИЕ =====================
+async def stats_maintenance_loop():
+    """Сохраняем статистику и архивируем пользователей независимо от команд"""
+    while True:
+        try:
+            await run_blocking(statistics.run_maintenance)
+        except Exception as e:
+            logger.error(f"Ошибка обслуживания статистики: {e}")
+        await asyncio.sleep(STATS_MAINTENANCE_INTERVAL)
+
 # ===================== ГЛАВНАЯ ФУНКЦИЯ =====================
 
 def main():
     """Главная функция запуска бота"""
-    global parser, statistics
+    global parser, statistics, history, throttler
     
     # Проверяем токен
     if not TOKEN:
@@ -834,8 +2830,10 @@ def main():
         return
     
     # Инициализируем парсер и статистику
-    parser = FFCParser()
+    history = SlotHistoryStore()
+    parser = FFCParser(history=history)
     statistics = BotStatistics()
+    throttler = RequestThrottler()
     
     # Очищаем пустые значения в ADMIN_IDS
     admin_ids_clean = [id.strip() for id in ADMIN_IDS if id.strip()]
@@ -852,21 +2850,31 @@ def main():
         # КРИТИЧЕСКИ ВАЖНО: сбрасываем все старые соединения
         await app.bot.delete_webhook(drop_pending_updates=True)
         await setup_bot_commands(app)
+        app.bot_data['maintenance_task'] = asyncio.get_running_loop().create_task(stats_maintenance_loop())
         logger.info("✅ Конфликты сброшены, бот готов к работе")
     
     try:
         # Создаем и настраиваем приложение
         application = Application.builder() \
             .token(TOKEN) \
+            .concurrent_updates(PerChatUpdateProcessor(MAX_CONCURRENT_UPDATES)) \
             .post_init(post_init) \
             .build()
         
+        # Локальный JSON API для внутренних сервисов поверх того же кэша
+        api_server = start_api_server()
+        
         # Регистрируем обработчики команд
         application.add_handler(CommandHandler("start", start_command))
         application.add_handler(CommandHandler("slots", slots_command))
+        application.add_handler(CommandHandler("next", next_command))
         application.add_handler(CommandHandler("venues", venues_command))
         application.add_handler(CommandHandler("help", help_command))
         application.add_handler(CommandHandler("stats", stats_command))
+        application.add_handler(CommandHandler("history", history_command))
+        application.add_handler(CallbackQueryHandler(
+            slots_page_callback, pattern=f"^{SLOTS_CALLBACK_PREFIX}:"
+        ))
         
         # Запускаем бота в режиме постоянного опроса
         logger.info("✅ Бот запущен и ожидает команд...")
@@ -877,6 +2885,15 @@ def main():
             close_loop=False
         )
         
+        # Останавливаем API и сохраняем историю слотов, накопленную с последней записи
+        if api_server is not None:
+            api_server.shutdown()
+        history.save(force=True)
+        statistics.flush()
+        PARSER_EXECUTOR.shutdown(wait=True)
+        parser.fetcher.shutdown()
+        BLOCKING_EXECUTOR.shutdown(wait=True)
+        
     except Conflict as e:
         logger.error(f"🚨 КОНФЛИКТ: Запущено несколько ботов одновременно")
         logger.error("Решение: Подождите 2 минуты или перезапустите в Railway")
@@ -888,6 +2905,10 @@ def main():
 
 # ===================== ТОЧКА ВХОДА =====================
 if __name__ == "__main__":
+    # Консольный режим профилирования: python bot.py pipeline --help
+    if len(sys.argv) > 1 and sys.argv[1] == "pipeline":
+        sys.exit(pipeline_main(sys.argv[2:]))
+    
     # Проверяем, что мы на Railway (или локально для теста)
     if "RAILWAY_ENVIRONMENT" in os.environ:
         logger.info("🌐 Среда: Railway (продакшн)")
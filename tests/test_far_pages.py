@@ -0,0 +1,66 @@
+import threading
+import time
+
+import pytest
+
+import bot
+
+
+@pytest.fixture
+def parser():
+    parser = bot.FFCParser()
+    yield parser
+    parser.fetcher.shutdown()
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_page_lock_lives_while_someone_waits(parser, monkeypatch):
+    monkeypatch.setattr(bot, "FAR_CACHE_PAGES", 1)
+    venue_key, other_key = list(parser.venues)[:2]
+    page_key = (venue_key, parser.get_week_dates(bot.NEAR_WEEKS)[0])
+    release = threading.Event()
+    calls = []
+
+    def fetch(venue_id, date_str):
+        calls.append(venue_id)
+        # Держим загрузку страницы на одной дате, не занимая все фоновые потоки
+        if venue_id == parser.venues[venue_key]['id'] and date_str == page_key[1]:
+            release.wait()
+        return []
+
+    monkeypatch.setattr(parser, "fetch_slots_from_api", fetch)
+    # Страница уже в кэше, но устарела — ее перезагружают
+    parser._far_pages[page_key] = {'result': {}, 'timestamp': 0, 'ttl': bot.FAR_PAGE_TTL}
+    results = []
+
+    def load():
+        results.append(parser.get_far_venue_slots(venue_key, bot.NEAR_WEEKS))
+
+    threads = [threading.Thread(target=load) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: parser._far_locks.get(page_key, [None, 0])[1] == 2)
+
+    # Другая страница вытесняет устаревшую из LRU, но ее блокировка остается
+    parser.get_far_venue_slots(other_key, bot.NEAR_WEEKS)
+    assert page_key not in parser._far_pages
+    threads.append(threading.Thread(target=load))
+    threads[-1].start()
+    wait_until(lambda: parser._far_locks[page_key][1] == 3)
+
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 3 and results[0] is results[1] is results[2]
+    assert calls.count(parser.venues[venue_key]['id']) == 7
+    assert not parser._far_locks
+
+
+def test_far_pages_outlive_near_window():
+    assert bot.FAR_PAGE_TTL > bot.REFRESH_MAX_TTL
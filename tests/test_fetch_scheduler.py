@@ -0,0 +1,51 @@
+import threading
+
+import bot
+
+
+def make_pools(**concurrency):
+    return {
+        name: bot.TenantFetchPool(name, {'api_base': f"http://{name}.test", 'concurrency': limit})
+        for name, limit in concurrency.items()
+    }
+
+
+def test_workers_cover_every_tenant_limit():
+    fetcher = bot.FairFetchScheduler(make_pools(a=4, b=4, c=4))
+    try:
+        assert len(fetcher._threads) == 12
+    finally:
+        fetcher.shutdown()
+
+
+def test_slow_tenant_does_not_delay_other_tenant():
+    fetcher = bot.FairFetchScheduler(make_pools(slow=2, fast=2))
+    release = threading.Event()
+    try:
+        stuck = [fetcher.submit('slow', release.wait) for _ in range(10)]
+        # Быстрая сеть получает свои потоки, пока медленная ждет ответа
+        done = fetcher.map('fast', lambda value: value * 2, [(value,) for value in range(5)])
+        assert done == [0, 2, 4, 6, 8]
+        assert fetcher.get_stats()['slow'] == {'queued': 8, 'active': 2}
+    finally:
+        release.set()
+        fetcher.shutdown()
+    assert all(future.result() for future in stuck)
+
+
+def test_each_tenant_has_own_refresh_budget():
+    tenants = {
+        'a': {'api_base': "http://a.test", 'refresh_budget': 100, 'venues': {'va': {'id': "1", 'name': "A"}}},
+        'b': {'api_base': "http://b.test", 'venues': {'vb': {'id': "2", 'name': "B"}}},
+    }
+    parser = bot.FFCParser(tenants=tenants)
+    try:
+        assert parser.schedulers['a'].budget_per_hour == 100
+        assert parser.schedulers['b'].budget_per_hour == bot.REFRESH_REQUEST_BUDGET
+
+        # Запросы дальних недель одной сети не тратят бюджет другой
+        parser._scheduler('va').note_requests(50, 0)
+        assert len(parser.schedulers['a']._extra_requests) == 50
+        assert not parser.schedulers['b']._extra_requests
+    finally:
+        parser.fetcher.shutdown()
@@ -0,0 +1,118 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import bot
+
+
+def brute_force_find(blocks, length, window_start, window_end):
+    for start, end, price in zip(blocks.starts, blocks.ends, blocks.prices):
+        clipped = (max(start, window_start), min(end, window_end), price)
+        if clipped[1] - clipped[0] >= length:
+            return clipped
+    return None
+
+
+def test_adjacent_and_overlapping_slots_merge():
+    blocks = bot.FreeBlocks([
+        (600, 660, 3000),
+        (540, 600, 2500),   # вплотную слева
+        (630, 720, 4000),   # пересекается
+        (900, 960, 2000),   # отдельно
+    ])
+    assert list(zip(blocks.starts, blocks.ends)) == [(540, 720), (900, 960)]
+    # Цена интервала — минимальная цена его слотов
+    assert blocks.prices == [2500, 2000]
+    assert len(blocks) == 2
+
+
+def test_find_block_clips_to_window():
+    blocks = bot.FreeBlocks([(540, 720, 1000), (900, 1080, 1000)])
+    assert blocks.find_block(60, 600, 1440) == (600, 720, 1000)
+    assert blocks.find_block(150, 600, 1440) == (900, 1080, 1000)
+    assert blocks.find_block(150, 600, 1000) is None
+    assert blocks.find_block(30, 720, 900) is None
+
+
+def test_blocks_in_window_drops_short_remainders():
+    blocks = bot.FreeBlocks([(480, 540, 1000), (600, 720, 1000), (1260, 1320, 1000)])
+    assert blocks.blocks_in_window(510, 1290, 30) == [(510, 540, 1000), (600, 720, 1000), (1260, 1290, 1000)]
+    assert blocks.blocks_in_window(520, 1290, 30) == [(600, 720, 1000), (1260, 1290, 1000)]
+    assert bot.FreeBlocks([]).blocks_in_window(0, 1440, 30) == []
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_find_block_matches_brute_force(seed):
+    rnd = random.Random(seed)
+    intervals = []
+    for _ in range(rnd.randint(0, 40)):
+        start = rnd.randrange(0, 1440, 30)
+        intervals.append((start, min(1440, start + rnd.choice([30, 60, 90, 120, 240])), rnd.randint(1, 9) * 500))
+    blocks = bot.FreeBlocks(intervals)
+
+    for _ in range(200):
+        window_start = rnd.randrange(0, 1440, 15)
+        window_end = rnd.randrange(window_start, 1441, 15)
+        length = rnd.choice([15, 30, 60, 90, 120, 180, 300])
+        assert blocks.find_block(length, window_start, window_end) == \
+            brute_force_find(blocks, length, window_start, window_end)
+
+
+def make_slot(date_str, start, end, room, price=2000, duration=60):
+    day = bot.MOSCOW_TZ.localize(datetime.strptime(date_str, "%Y-%m-%d"))
+    hours, minutes = map(int, start.split(':'))
+    return {
+        'start': start,
+        'end': end,
+        'room': room,
+        'price': price,
+        'duration_minutes': duration,
+        'datetime': day + timedelta(hours=hours, minutes=minutes),
+        'unique_key': f"{date_str}{start}|{room}",
+    }
+
+
+def test_parser_builds_blocks_per_date_and_room():
+    parser = bot.FFCParser()
+    try:
+        slots = [
+            make_slot("2026-10-20", "19:00", "20:00", "Поле 1"),
+            make_slot("2026-10-20", "20:00", "21:00", "Поле 1", price=1500),
+            make_slot("2026-10-20", "20:00", "21:00", "Поле 1"),  # дубликат
+            make_slot("2026-10-20", "19:00", "20:00", "Поле 2"),
+            make_slot("2026-10-20", "23:30", "00:30", "Поле 2"),  # через полночь
+        ]
+        free_blocks = parser.build_free_blocks(slots)
+        field_1 = free_blocks[("2026-10-20", "Поле 1")]
+        field_2 = free_blocks[("2026-10-20", "Поле 2")]
+        assert list(zip(field_1.starts, field_1.ends, field_1.prices)) == [(1140, 1260, 1500)]
+        assert list(zip(field_2.starts, field_2.ends)) == [(1140, 1200), (1410, 1440)]
+
+        filtered = parser.filter_slots_intelligently(slots)
+        assert [(slot['time'], slot['room']) for slot in filtered] == [
+            ("19:00-21:00", "Поле 1"), ("19:00-20:00", "Поле 2")
+        ]
+        assert filtered[0]['price'] == bot.format_block_price(1500)
+    finally:
+        parser.fetcher.shutdown()
+
+
+def test_next_free_blocks_takes_earliest_first():
+    parser = bot.FFCParser()
+    try:
+        venue_key = next(iter(parser.venues))
+        day = (datetime.now(bot.MOSCOW_TZ) + timedelta(days=2)).strftime("%Y-%m-%d")
+        later = (datetime.now(bot.MOSCOW_TZ) + timedelta(days=3)).strftime("%Y-%m-%d")
+        parser._free_blocks[venue_key] = parser.build_free_blocks([
+            make_slot(later, "10:00", "11:00", "Поле 1"),
+            make_slot(day, "19:00", "20:00", "Поле 2"),
+            make_slot(day, "18:00", "19:00", "Поле 1"),
+        ])
+
+        found = parser.next_free_blocks(2, 60, 0, 24 * 60)
+        assert [(slot['time'], slot['room']) for _, slot in found] == [
+            ("18:00-19:00", "Поле 1"), ("19:00-20:00", "Поле 2")
+        ]
+    finally:
+        parser.fetcher.shutdown()
@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import bot
+
+
+def slot(hour, minute=0):
+    return {'start': f"{hour:02d}:{minute:02d}"}
+
+
+def timestamp(date_str, hour):
+    day = datetime.strptime(date_str, "%Y-%m-%d").replace(hour=hour)
+    return bot.MOSCOW_TZ.localize(day).timestamp()
+
+
+@pytest.fixture
+def store(tmp_path):
+    return bot.SlotHistoryStore(str(tmp_path / "history.json"))
+
+
+# Четыре субботы подряд; слот 10:00 был свободен только в первую
+SATURDAYS = ["2026-01-03", "2026-01-10", "2026-01-17", "2026-01-24"]
+SATURDAY = 5
+
+
+def record_saturdays(store):
+    for index, date_str in enumerate(SATURDAYS):
+        slots = [slot(10), slot(12)] if index == 0 else [slot(12)]
+        store.record_snapshot("seliger", date_str, slots, timestamp(date_str, 0) - 86400)
+
+
+def test_state_follows_toggles(store):
+    store.record_snapshot("seliger", "2026-01-03", [slot(10)], 1000)
+    store.record_snapshot("seliger", "2026-01-03", [], 2000)
+    store.record_snapshot("seliger", "2026-01-03", [slot(10)], 3500)
+
+    series = store.series["seliger|2026-01-03"]["600"]
+    assert series == {'t0': 1000, 's0': 1, 'd': [1000, 1500]}
+    assert store._state(series) == 1
+    assert store._toggle_times(series) == [2000, 3500]
+
+
+def test_slot_appearing_later_is_a_free_up(store):
+    date_str = "2026-01-03"
+    first_seen = timestamp(date_str, 10) - 3 * 3600
+    store.record_snapshot("seliger", date_str, [], first_seen)
+    store.record_snapshot("seliger", date_str, [slot(10)], first_seen + 3600)
+
+    result = store.query_free_ups(SATURDAY, 600)
+    assert result['dates'] == 1
+    assert result['free_dates'] == 1
+    # Освободился за 2 часа до начала
+    assert sum(result['leads']) == 1
+    assert result['leads'][store._lead_bucket(2)] == 1
+
+
+def test_free_share_survives_compaction(store):
+    record_saturdays(store)
+    before = store.query_free_ups(SATURDAY, 600)
+    assert (before['dates'], before['free_dates']) == (4, 1)
+
+    store.compact(timestamp(SATURDAYS[-1], 12) + (bot.HISTORY_RAW_DAYS + 1) * 86400)
+    assert not store.observed and not store.series
+
+    after = store.query_free_ups(SATURDAY, 600)
+    assert (after['dates'], after['free_dates']) == (4, 1)
+    assert store.query_free_ups(SATURDAY, 720)['free_dates'] == 4
+
+
+def test_query_filters_venue_and_weekday(store):
+    record_saturdays(store)
+    store.record_snapshot("kantem", SATURDAYS[0], [slot(10)], timestamp(SATURDAYS[0], 0))
+
+    assert store.query_free_ups(SATURDAY, 600)['dates'] == 5
+    assert store.query_free_ups(SATURDAY, 600, "kantem")['dates'] == 1
+    assert store.query_free_ups(SATURDAY - 1, 600)['dates'] == 0
+
+
+def test_save_and_reload_keeps_rollups(store):
+    record_saturdays(store)
+    store.compact(timestamp(SATURDAYS[-1], 12) + (bot.HISTORY_RAW_DAYS + 1) * 86400)
+    store.save(force=True)
+
+    reloaded = bot.SlotHistoryStore(store.history_file)
+    assert reloaded.query_free_ups(SATURDAY, 600) == store.query_free_ups(SATURDAY, 600)
@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import bot
+
+TODAY = bot.MOSCOW_TZ.localize(datetime(2026, 10, 19, 12, 0))
+NOW = TODAY.timestamp()
+
+
+def dates(count):
+    return [(TODAY + timedelta(days=offset)).strftime("%Y-%m-%d") for offset in range(count)]
+
+
+def slot(start, room="Поле 1"):
+    return {'start': start, 'room': room}
+
+
+def requests_per_hour(ttls):
+    return sum(3600 / ttl for ttl in ttls.values())
+
+
+def test_dates_without_history_get_default_ttl():
+    scheduler = bot.RefreshScheduler()
+    keys = [("seliger", date_str) for date_str in dates(3)]
+    assert scheduler.plan(keys, TODAY) == {key: bot.REFRESH_DEFAULT_TTL for key in keys}
+
+
+def test_churn_shortens_ttl_within_bounds():
+    scheduler = bot.RefreshScheduler()
+    busy, quiet = dates(2)
+    scheduler.record("seliger", busy, None, [slot("19:00")], NOW)
+    scheduler.record("seliger", busy, [slot("19:00")], [slot("20:00"), slot("21:00")], NOW + 600)
+    scheduler.record("seliger", quiet, None, [slot("19:00")], NOW)
+    scheduler.record("seliger", quiet, [slot("19:00")], [slot("19:00")], NOW + 600)
+
+    ttls = scheduler.plan([("seliger", busy), ("seliger", quiet)], TODAY)
+    assert ttls[("seliger", busy)] == bot.REFRESH_MIN_TTL
+    assert ttls[("seliger", quiet)] == bot.REFRESH_MAX_TTL
+
+
+def test_off_peak_changes_weigh_less():
+    scheduler = bot.RefreshScheduler()
+    date_str = dates(1)[0]
+    scheduler.record("seliger", date_str, None, [], NOW)
+    scheduler.record("seliger", date_str, [], [slot("03:00")], NOW + 3600)
+    scheduler.record("kantem", date_str, None, [], NOW)
+    scheduler.record("kantem", date_str, [], [slot("19:00")], NOW + 3600)
+
+    assert scheduler.churn_rate("seliger", date_str) == pytest.approx(bot.REFRESH_OFFPEAK_WEIGHT)
+    assert scheduler.churn_rate("kantem", date_str) == pytest.approx(1.0)
+
+
+def test_budget_stretches_uncapped_dates():
+    scheduler = bot.RefreshScheduler(budget_per_hour=20)
+    ttls = {("a", "1"): 120, ("a", "2"): 300, ("a", "3"): 3600, ("a", "4"): 1800}
+    fitted = scheduler._fit_budget(ttls, 20)
+
+    assert requests_per_hour(fitted) == pytest.approx(20)
+    assert all(bot.REFRESH_MIN_TTL <= ttl <= bot.REFRESH_MAX_TTL for ttl in fitted.values())
+    # Упершиеся в максимум даты не тянут остальные за бюджет
+    assert fitted[("a", "3")] == fitted[("a", "4")] == bot.REFRESH_MAX_TTL
+    assert fitted[("a", "2")] / fitted[("a", "1")] == pytest.approx(300 / 120)
+
+
+def test_budget_holds_when_max_ttl_is_not_enough():
+    scheduler = bot.RefreshScheduler(budget_per_hour=10)
+    keys = [("seliger", date_str) for date_str in dates(14)] + [("kantem", date_str) for date_str in dates(14)]
+    ttls = scheduler.plan(keys, TODAY)
+
+    assert requests_per_hour(ttls) == pytest.approx(10)
+    assert scheduler._over_budget
+
+
+def test_far_requests_count_against_budget():
+    scheduler = bot.RefreshScheduler(budget_per_hour=200)
+    keys = [("seliger", date_str) for date_str in dates(14)]
+    assert requests_per_hour(scheduler.plan(keys, TODAY)) == pytest.approx(14 * 3600 / bot.REFRESH_DEFAULT_TTL)
+
+    scheduler.note_requests(40, NOW - 60)
+    assert requests_per_hour(scheduler.plan(keys, TODAY)) == pytest.approx(160)
+
+    # Дальние недели не отнимают у ближнего окна больше REFRESH_NEAR_MIN_SHARE бюджета
+    scheduler.note_requests(100, NOW - 30)
+    assert requests_per_hour(scheduler.plan(keys, TODAY)) == pytest.approx(200 * bot.REFRESH_NEAR_MIN_SHARE)
+
+    # Через час они перестают учитываться
+    later = TODAY + timedelta(hours=1)
+    assert requests_per_hour(scheduler.plan(keys, later)) == pytest.approx(14 * 3600 / bot.REFRESH_DEFAULT_TTL)
@@ -0,0 +1,58 @@
+import json
+from datetime import datetime, timedelta
+
+import bot
+import pytest
+
+
+@pytest.fixture
+def stats(tmp_path):
+    return bot.BotStatistics(str(tmp_path / "bot_statistics.json"))
+
+
+def venue(name, *times):
+    return {'name': name, 'slots': [{'date': "20.10.2026", 'time': time, 'room': "Поле 1"} for time in times]}
+
+
+def test_slots_found_counts_only_new_slots(stats):
+    stats.log_slots_found({'a': venue("A", "19:00-20:00", "21:00-22:00"), 'b': venue("B", "19:00-20:00")}, 1)
+    assert stats.stats['slots_found']['total'] == 3
+
+    # Обновилась только площадка A, у B кэш без изменений
+    stats.log_slots_found({'a': venue("A", "19:00-20:00", "22:00-23:00"), 'b': venue("B", "19:00-20:00")}, 2)
+    assert stats.stats['slots_found']['total'] == 4
+    assert stats.stats['slots_found']['by_venue'] == {"A": 3, "B": 1}
+
+    # То же обновление кэша повторно не учитывается
+    stats.log_slots_found({'a': venue("A", "08:00-09:00")}, 2)
+    assert stats.stats['slots_found']['total'] == 4
+
+
+def test_commands_batch_file_writes(stats):
+    stats.add_user(1, "user", "User")
+    written = json.load(open(stats.stats_file, encoding='utf-8'))
+    assert "1" in written['users']
+
+    # Следующие команды в пределах интервала копятся в памяти
+    stats.log_command(1, 'slots')
+    stats.log_command(1, 'slots')
+    written = json.load(open(stats.stats_file, encoding='utf-8'))
+    assert written['users']["1"]['commands_used'] == 0
+
+    stats.flush()
+    written = json.load(open(stats.stats_file, encoding='utf-8'))
+    assert written['users']["1"]['commands_used'] == 2
+
+
+def test_maintenance_archives_without_slots_requests(stats):
+    stats.add_user(1, "old", "Old")
+    stats.add_user(2, "new", "New")
+    stale = datetime.now(bot.MOSCOW_TZ) - timedelta(days=bot.STATS_USER_ARCHIVE_DAYS + 1)
+    stats.stats['users']["1"]['last_seen'] = stale.isoformat()
+
+    stats.run_maintenance()
+
+    assert list(stats.stats['users']) == ["2"]
+    assert stats.stats['archive']['users'] == 1
+    written = json.load(open(stats.stats_file, encoding='utf-8'))
+    assert list(written['users']) == ["2"]
@@ -0,0 +1,93 @@
+import asyncio
+from datetime import datetime
+
+from telegram import CallbackQuery, Chat, Message, Update, User
+
+import bot
+
+USER = User(1, "User", False)
+
+
+def message(chat_id, message_id=1):
+    return Message(message_id, datetime(2026, 10, 19), Chat(chat_id, Chat.PRIVATE), from_user=USER, text="/slots")
+
+
+def command(update_id, chat_id):
+    return Update(update_id, message=message(chat_id, message_id=update_id))
+
+
+def press(update_id, chat_id, message_id):
+    query = CallbackQuery(str(update_id), USER, "chat", message=message(chat_id, message_id), data="slots:0:0:0")
+    return Update(update_id, callback_query=query)
+
+
+def make_processor(max_concurrent, monkeypatch):
+    skipped = []
+
+    async def skip(query):
+        skipped.append(query.id)
+
+    monkeypatch.setattr(bot.PerChatUpdateProcessor, "_skip_callback", staticmethod(skip))
+    return bot.PerChatUpdateProcessor(max_concurrent), skipped
+
+
+async def record(log, name, gate=None):
+    log.append(f"{name}:start")
+    if gate is not None:
+        await gate.wait()
+    log.append(f"{name}:end")
+
+
+def test_updates_of_one_chat_run_in_order(monkeypatch):
+    async def scenario():
+        proc, _ = make_processor(4, monkeypatch)
+        log, gate = [], asyncio.Event()
+        first = asyncio.create_task(proc.process_update(command(1, 10), record(log, "a1", gate)))
+        second = asyncio.create_task(proc.process_update(command(2, 10), record(log, "a2")))
+        other = asyncio.create_task(proc.process_update(command(3, 20), record(log, "b1")))
+        await asyncio.sleep(0)
+        await other
+        # Другой чат не ждет, второе обновление чата ждет первое
+        assert log == ["a1:start", "b1:start", "b1:end"]
+        gate.set()
+        await asyncio.gather(first, second)
+        assert log[3:] == ["a1:end", "a2:start", "a2:end"]
+        assert not proc._chat_locks and not proc._chat_pending
+
+    asyncio.run(scenario())
+
+
+def test_queued_updates_do_not_hold_concurrency_slots(monkeypatch):
+    async def scenario():
+        proc, _ = make_processor(2, monkeypatch)
+        log, gate = [], asyncio.Event()
+        busy = [asyncio.create_task(proc.process_update(command(i, 10), record(log, f"a{i}", gate)))
+                for i in range(1, 4)]
+        await asyncio.sleep(0)
+        # Выполняется одно обновление чата, ждущие в очереди место не занимают
+        assert proc._semaphore._value == 1
+        await proc.process_update(command(9, 20), record(log, "b"))
+        assert "b:end" in log
+        gate.set()
+        await asyncio.gather(*busy)
+        assert proc._semaphore._value == 2
+
+    asyncio.run(scenario())
+
+
+def test_only_last_queued_press_runs(monkeypatch):
+    async def scenario():
+        proc, skipped = make_processor(4, monkeypatch)
+        log, gate = [], asyncio.Event()
+        running = asyncio.create_task(proc.process_update(command(1, 10), record(log, "cmd", gate)))
+        await asyncio.sleep(0)
+        presses = [asyncio.create_task(proc.process_update(press(i, 10, 5), record(log, f"press{i}")))
+                   for i in range(2, 5)]
+        other = asyncio.create_task(proc.process_update(press(5, 10, 6), record(log, "press5")))
+        await asyncio.sleep(0)
+        gate.set()
+        await asyncio.gather(running, *presses, other)
+        assert [entry for entry in log if entry.endswith(":start")] == ["cmd:start", "press4:start", "press5:start"]
+        assert skipped == ["2", "3"]
+
+    asyncio.run(scenario())